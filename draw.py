@@ -1,18 +1,60 @@
 """
 generate-graph.py: automatically generate (tikz) images and tables
     from SLR results.
+
+    usage: python draw.py [--force] [target...]
+           python draw.py --bench [keys]
+
+    Figures are declared in SPEC: each input JSON is loaded once and
+    drawn as a pie chart, a table, or both. Tables are streamed to
+    the output row by row, as a tabular, or as a longtable if their
+    SPEC entry asks for it (only for tables input outside a float).
+
+    A figure is only regenerated if the hash of its input and of this
+    script differs from the one recorded in STATE_FILE, and a file is
+    only written if its content changed, so that make does not rebuild
+    main.pdf for nothing. --force regenerates all (given) targets.
 """
+import filecmp
+import hashlib
+import io
 import json
 import os
+import sys
+import tempfile
+import time
+
+STATE_FILE = os.path.join('figures', 'draw-state.json')
+
+def write_if_changed(ofile: str, draw) -> bool:
+    """
+    Let draw(path) write to a temporary file, and only replace
+    ofile by it if their content differ.
+
+    :return: whether ofile was (re)written.
+    """
+    tmp = ofile + '.tmp'
+    draw(tmp)
+    if os.path.exists(ofile) and filecmp.cmp(tmp, ofile, shallow=False):
+        os.remove(tmp)
+        return False
+    os.replace(tmp, ofile)
+    return True
 
-def make_deps(targets: list[str]):
-    with open("images.d", "w") as fobj:
-        fobj.write("figures/lang.tex: draw.py pdfs/benchmark/language.json\n")
-        fobj.write('main.pdf: images.d ')
-        fobj.write(' '.join(targets) + '\n')
-    
-        for target in targets:
-            fobj.write(f"{target}:\n\tpython draw.py\n")
+
+def make_deps(figures: list[tuple]):
+    def draw(path: str):
+        with open(path, "w") as fobj:
+            inputs: dict[str, list[str]] = dict()
+            for target, ifile, _, _ in figures:
+                inputs.setdefault(ifile, []).append(target)
+            fobj.write('main.pdf: images.d ')
+            fobj.write(' '.join(f[0] for f in figures) + '\n')
+
+            for ifile, targets in inputs.items():
+                fobj.write(f"{' '.join(targets)}: draw.py {ifile}\n\tpython draw.py $@\n")
+
+    write_if_changed("images.d", draw)
 
 
 def draw_pie(ofile: str, dat: dict):
@@ -66,6 +108,34 @@ def draw_pie(ofile: str, dat: dict):
         fobj.write("\\end{tikzpicture}\n")
 
 
+def write_table(fobj, keys: list[str], items, longtable: bool = False) -> int:
+    """
+    Stream a latex table with given keys and items (an iterable of
+    dict) to fobj, one row at a time.
+
+    With longtable, the header is repeated on each page; note that a
+    longtable cannot be put in a table float.
+
+    :return: the number of rows written.
+    """
+    env = 'longtable' if longtable else 'tabular'
+    fobj.write(f"\\begin{{{env}}}{{{'l' * len(keys)}}}\n\\hline\n")
+    fobj.write(' & '.join(k.title() for k in keys) + "  \\\\ \\hline\n")
+    if longtable:
+        fobj.write("\\endhead\n")
+
+    rows = 0
+    for it in items:
+        if len(it) != len(keys):
+            raise ValueError("each item should have the same number of keys as the keys list")
+        fobj.write(' & '.join(str(it[k]) for k in keys) + "  \\\\\n")
+        rows += 1
+    if rows == 0:
+        raise ValueError("items should not be empty")
+    fobj.write(f"\\hline\n\\end{{{env}}}\n")
+    return rows
+
+
 def create_table(keys: list[str], items: list[dict]) -> str:
     """
     Create a latex table with given keys and items.
@@ -82,79 +152,146 @@ def create_table(keys: list[str], items: list[dict]) -> str:
     Bears & 2024 \\\\ \\hline
     \\end{tabular}
     """
-    if not items:
-        raise ValueError("items should not be empty")
-    num_keys = len(keys)
-    for it in items:
-        if len(it) != num_keys:
-            raise ValueError("each item should have the same number of keys as the keys list")
-    ret = "\\begin{tabular}{"
-    for _ in keys:
-        ret += "l"
-    ret += "}\n\\hline\n"
-
-    for k in keys:
-        ret += k.title() + " & "
-    ret = ret[:-2] + " \\\\ \\hline\n"
-
-    for i in range(len(items)):
-        for k in keys:
-            ret += str(items[i][k]) + " & "
-        ret = ret[:-2] + " \\\\\n"
-    ret += "\\hline\n\\end{tabular}\n"
-    return ret
+    buf = io.StringIO()
+    write_table(buf, keys, items)
+    return buf.getvalue()
 
 
-def draw_references_table(ofile: str, dat: dict, keys: tuple[str, str]):
+def draw_references_table(ofile: str, dat: dict, keys: tuple[str, str],
+                          longtable: bool = False):
     """
     :param: dat: a dictionary like pdfs/benchmark/language.json
     :param: keys: Descriptions of what the key/value of dat means.
+    :param: longtable: paginate with longtable; the table must then
+        not be input inside a table float.
     """
-    items = []
     table_header_keys = [keys[0], "Total", keys[1]]
 
-    total = 0
-    for k in dat:
-        kstr: str = k
-        vlist: list = dat[k]
-        assert isinstance(vlist, list)
-
-        reference_list:str = '(None)'
-        if len(vlist):
-            reference_list = '\\citep{' + ', '.join(vlist) + "}"
-        total += len(vlist)
-        items.append({keys[0]: kstr.title(), 'Total': len(vlist), keys[1]: reference_list})
-
-    items.append({keys[0]: 'All', 'Total': total, keys[1]: ''})
-    table_code = create_table(table_header_keys, items)
+    def items():
+        total = 0
+        for k in dat:
+            kstr: str = k
+            vlist: list = dat[k]
+            assert isinstance(vlist, list)
+
+            reference_list:str = '(None)'
+            if len(vlist):
+                reference_list = '\\citep{' + ', '.join(vlist) + "}"
+            total += len(vlist)
+            yield {keys[0]: kstr.title(), 'Total': len(vlist), keys[1]: reference_list}
+        yield {keys[0]: 'All', 'Total': total, keys[1]: ''}
+
     with open(ofile, "w") as fobj:
-        fobj.write(table_code)
-    del table_code
+        write_table(fobj, table_header_keys, items(), longtable)
 
 
-if __name__ == "__main__":
-    image_dir = 'figures'
-    if not os.path.exists(image_dir):
-        os.makedirs(image_dir)
-    deps = ['figures/lang.tex', 
-            'figures/lang-tab.tex', 
-            'figures/data.tex',
-            'figures/data-tab.tex']
+GENERATORS = {
+    'pie': draw_pie,
+    'table': draw_references_table,
+}
+
+# input -> {kind of figure: (target, extra arguments of the generator)}
+# a table input outside of a float may pass longtable=True, e.g.
+# ('figures/x-tab.tex', (("X", "References"), True))
+SPEC = {
+    'pdfs/benchmark/language.json': {
+        'pie': ('figures/lang.tex', ()),
+        'table': ('figures/lang-tab.tex', (("Programming Language", "References"),)),
+    },
+    # source of datasets
+    'pdfs/benchmark/source.json': {
+        'pie': ('figures/data.tex', ()),
+        'table': ('figures/data-tab.tex', (("Data Source", "References"),)),
+    },
+}
 
-    # figures/lang.tex
-    src = json.load(open(os.path.join('pdfs', 'benchmark', 'language.json')))
-    draw_pie(os.path.join(image_dir, "lang.tex"), src)
 
-    # figures/lang-tab.tex
-    draw_references_table(os.path.join(image_dir, "lang-tab.tex"), src, 
-                          ("Programming Language", "References"))
+def figures(spec: dict) -> list[tuple]:
+    """
+    :return: (target, input, generator, extra arguments) of each
+        figure of spec, grouped by input.
+    """
+    return [(target, ifile, GENERATORS[kind], args)
+            for ifile, kinds in spec.items()
+            for kind, (target, args) in kinds.items()]
 
-    # figures/data.tex, source of datasets
-    src = json.load(open(os.path.join('pdfs', 'benchmark', 'source.json')))
-    draw_pie(os.path.join(image_dir, "data.tex"), src)
 
-    # figures/data-tab.tex
-    draw_references_table(os.path.join(image_dir, "data-tab.tex"), src, 
-                          ("Data Source", "References"))
+FIGURES = figures(SPEC)
+
+
+def input_hash(target: str, ifile: str) -> str:
+    """
+    Hash of everything target is generated from: this script and ifile.
+    """
+    sha = hashlib.sha256(target.encode('utf-8'))
+    for path in (__file__, ifile):
+        with open(path, 'rb') as fobj:
+            sha.update(hashlib.sha256(fobj.read()).digest())
+    return sha.hexdigest()
+
+
+def generate(targets: list[str] | None = None, force: bool = False):
+    """
+    Regenerate the (given) figures whose inputs changed.
+    """
+    state: dict[str, str] = dict()
+    if os.path.exists(STATE_FILE):
+        with open(STATE_FILE, 'r') as fobj:
+            state = json.load(fobj)
+
+    loaded: dict[str, dict] = dict()
+    for target, ifile, generator, args in FIGURES:
+        if targets is not None and target not in targets:
+            continue
+        digest = input_hash(target, ifile)
+        if not force and state.get(target, None) == digest and os.path.exists(target):
+            continue
+        if ifile not in loaded:
+            with open(ifile, 'r') as fobj:
+                loaded[ifile] = json.load(fobj)
+        if write_if_changed(target, lambda path: generator(path, loaded[ifile], *args)):
+            print(f"Remake {target}", file=sys.stderr)
+        state[target] = digest
+
+    def draw(path: str):
+        with open(path, 'w') as fobj:
+            json.dump(state, fobj, indent=1, sort_keys=True)
+    write_if_changed(STATE_FILE, draw)
+
+
+def bench(num_keys: int = 10000):
+    """
+    Time the generators on a synthetic input of num_keys keys.
+    """
+    dat = {f"key {i}": [f"ref{i}x{j}" for j in range(i % 5)] for i in range(num_keys)}
+    with tempfile.TemporaryDirectory() as tmp:
+        ifile = os.path.join(tmp, 'input.json')
+        start = time.perf_counter()
+        with open(ifile, 'w') as fobj:
+            json.dump(dat, fobj)
+        with open(ifile, 'r') as fobj:
+            dat = json.load(fobj)
+        print(f"json: {time.perf_counter() - start:.3f}s")
+        for kind, generator, args in (('pie', draw_pie, ()),
+                                      ('table', draw_references_table, (("Key", "References"),))):
+            ofile = os.path.join(tmp, kind + '.tex')
+            start = time.perf_counter()
+            generator(ofile, dat, *args)
+            print(f"{kind}: {time.perf_counter() - start:.3f}s, "
+                  f"{os.path.getsize(ofile) / 1024:.0f} KiB")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == '--bench':
+        bench(*[int(arg) for arg in sys.argv[2:3]])
+        sys.exit(0)
+
+    image_dir = 'figures'
+    if not os.path.exists(image_dir):
+        os.makedirs(image_dir)
 
-    make_deps(deps)
+    args = sys.argv[1:]
+    force = '--force' in args
+    targets = [arg for arg in args if arg != '--force']
+    generate(targets if len(targets) > 0 else None, force)
+    make_deps(FIGURES)
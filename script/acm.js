@@ -65,3 +65,23 @@ var export_cited_by = function () {
     }
     return result;
 };
+
+// everything extracted from the page, in a single round trip.
+var export_page = function () {
+    var ret = page_metadata();
+    // a list that cannot be exported is null, without losing the other.
+    var lines = function (export_list) {
+        try {
+            var text = export_list();
+            if (text == null) {
+                return [];
+            }
+            return text.split('\n').filter(function (line) { return line.length > 0; });
+        } catch (e) {
+            return null;
+        }
+    };
+    ret.references = lines(export_references);
+    ret.cited_by = lines(export_cited_by);
+    return ret;
+};
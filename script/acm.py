@@ -1,19 +1,36 @@
 """
 DESCRIPTION
-    Export reference list and cited by list of a given article.
+    Export reference list and cited by list of a given article,
+    starting at most one page per domain every DELAY seconds.
+
+ENVIRONMENT
+    DELAY: min seconds between the start of two page loads (default: 1)
 """
 import os
 import sys
 import time
-import bibtexparser
+import bibload
+import metrics
 from seleniumbase import Driver
+from browserpool import BrowserPool, undetected_chrome, js_lib
+from throttle import domain_name, scheduled_map
+from citegraph import page_record
 
 class ACM():
+    @staticmethod
+    def get_page(browser: Driver) -> dict:
+        """
+        References, cited by list and metadata of the page,
+        in a single round trip.
+
+        :return: dict with keys url, title, doi, references, cited_by.
+        """
+        with metrics.timer('execute_script', 'dl.acm.org'):
+            return browser.execute_script(js_lib('acm.js') + "\nreturn export_page();")
+
     @staticmethod
     def get_references(browser: Driver) -> list[str]: 
-        with open('acm.js', 'r') as f:
-            lib: str = f.read()
-        script = lib + \
+        script = js_lib('acm.js') + \
 """
 return export_references();
 """
@@ -21,9 +38,7 @@ return export_references();
 
     @staticmethod
     def get_cited_by(browser: Driver) -> list[str]:
-        with open('acm.js', 'r') as f:
-            lib: str = f.read()
-        script = lib + \
+        script = js_lib('acm.js') + \
 """
 return export_cited_by();
 """
@@ -31,43 +46,62 @@ return export_cited_by();
         return [] if result is None else result.splitlines()
 
 
+def scrape(pool: BrowserPool, url: str) -> tuple[list[str] | None, list[str] | None]:
+    """
+    :return: references and cited by list of the article,
+        each None if it could not be exported.
+    """
+    references = None
+    cited_by = None
+    try:
+        with pool.lease() as browser:
+            with metrics.timer('page.load', metrics.domain(url)):
+                browser.uc_open_with_reconnect(url, reconnect_time=10)
+            time.sleep(2)
+            page = ACM.get_page(browser)
+            references = page['references']
+            cited_by = page['cited_by']
+    except Exception as e:
+        print(e, file=sys.stderr)
+    return references, cited_by
+
+
 if __name__ == "__main__":
-    browser = None# Driver(headless=False, uc = True)
+    pool = BrowserPool(undetected_chrome)
 
     bibfile = os.path.join("..", "dataset", "acm.bib")
     bibfile = 'test.bib'
-    lib = bibtexparser.load(open(bibfile, 'r', encoding = 'utf-8'))
+    lib = bibload.load(bibfile)
     logfile = open("acm.log", 'w', encoding = 'utf-8')
     reffile = open("acm.txt", 'w', encoding = 'utf-8')
+    pagefile = open("acm.jsonl", 'w', encoding = 'utf-8')
 
-    for entry in lib.entries:
-        if 'url' not in entry:
-            continue
-        url = entry['url']
-        browser = Driver(headless=False, uc = True)
-        refereces_success = False
-        all_success = False
-        try:
-            browser.uc_open_with_reconnect(url, reconnect_time=10)
-            references = ACM.get_references(browser)
-            refereces_success = True 
-            time.sleep(2)
-            cited_by = ACM.get_cited_by(browser)
-            all_success = True
-        except Exception as e:
-            print(e, file=sys.stderr)
-            logfile.write(f"Error: {url}\n")
+    try:
+        entries = [entry for entry in lib.entries if 'url' in entry]
+        tasks = [(domain_name(entry['url']), entry['url']) for entry in entries]
+        delay = float(os.environ.get('DELAY', '1'))
+        for entry, (references, cited_by) in zip(entries, scheduled_map(lambda u: scrape(pool, u), tasks,
+                                                                        pool.size, pool.size, delay)):
+            url = entry['url']
+            if references is not None or cited_by is not None:
+                pagefile.write(page_record(entry, references, cited_by) + "\n")
+                pagefile.flush()
+            if references is None:
+                logfile.write(f"Error (references): {url}\n")
+            if cited_by is None:
+                logfile.write(f"Error (cited by): {url}\n")
             logfile.flush()
-        browser.quit()
-        time.sleep(1)
-        if refereces_success:
-            for ref in references:
-                reffile.write(ref + "\n")
-            del references
-        if all_success:
-            for ref in cited_by:
-                reffile.write(ref + "\n")
-            del cited_by
-        reffile.flush()
+            if references is not None:
+                for ref in references:
+                    reffile.write(ref + "\n")
+                del references
+            if cited_by is not None:
+                for ref in cited_by:
+                    reffile.write(ref + "\n")
+                del cited_by
+            reffile.flush()
+    finally:
+        pool.close()
+    pagefile.close()
     reffile.close()
     logfile.close()
@@ -16,4 +16,26 @@ var export_reference = function (id) {
     }
 
     return ret.replaceAll("\n", " ").replace("↑", ";").trim();
-};
\ No newline at end of file
+};
+
+var export_references = function () {
+    var ret = [];
+    for (var id = 1; ; id++) {
+        var ref = export_reference(id);
+        if (ref == null) {
+            break;
+        }
+        if (ref != '') {
+            ret.push(ref);
+        }
+    }
+    return ret;
+};
+
+// everything extracted from the page, in a single round trip.
+var export_page = function () {
+    var ret = page_metadata();
+    ret.references = export_references();
+    ret.cited_by = [];
+    return ret;
+};
@@ -1,81 +1,230 @@
+"""
+SYNOPSIS
+    arxiv.py
+
+DESCRIPTION
+    Export the reference list of the articles in ../dataset/arxiv.bib
+    to arxiv.txt.
+
+    The html version of arXiv papers is static, so references are
+    read with plain HTTP requests, PER_DOMAIN at a time, starting at
+    most one page every DELAY seconds (see throttle.DomainScheduler).
+    A headless browser is only used for the papers that fail, DELAY
+    seconds after their request. Each paper is written out as soon as
+    it is done, so an interrupted run keeps what it has read.
+
+ENVIRONMENT
+    ARXIV_BASE_URL: where html papers are fetched from
+        (default: https://arxiv.org/html/)
+    PER_DOMAIN: number of papers fetched at the same time (default: 4)
+    DELAY: min seconds between the start of two fetches (default: 1)
+"""
 import os
+import re
 import sys
-import bibtexparser
-from selenium import webdriver
-from selenium.webdriver.firefox.options import Options
 import time
+import bibload
+import metrics
+import requests
+from html.parser import HTMLParser
+from selenium import webdriver
+from browserpool import BrowserPool, headless_firefox, js_lib
+from throttle import domain_name, scheduled_as_completed
+from citegraph import page_record
+
+ARXIV_HTML = os.environ.get('ARXIV_BASE_URL', 'https://arxiv.org/html/')
+TIMEOUT = 60
 
 class ArXiv():
     @staticmethod
-    def _get_reference(browser: webdriver, id: int) -> str | None:
-        jsscript = """
-    let node = document.querySelector("#bib\\\\.bib" + arguments[0]);
-    if (node == null) {
-        return null;
-    }
-    let children = node.childNodes;
-    let ret = '';
-    for (let i = 0; i < children.length; i++) {
-        let child = children[i];
-        if (i == 0) {
-            continue;
-        } else {
-            ret += ' ';
-        }
-        ret += child.textContent;
-    }
-
-    return ret.replaceAll("\\n", " ").replace("↑", ";").trim();
-"""
-        result  = browser.execute_script(jsscript, str(id))
-        return result
+    def get_page(browser: webdriver) -> dict:
+        """
+        References and metadata of the page, in a single round trip.
+
+        :return: dict with keys url, title, doi, references, cited_by.
+        """
+        with metrics.timer('execute_script', 'arxiv.org'):
+            return browser.execute_script(js_lib('arxiv.js') + "\nreturn export_page();")
 
     @staticmethod
     def get_references(browser: webdriver) -> list[str]:
-        id = 1
+        return ArXiv.get_page(browser)['references']
+
+    @staticmethod
+    def parse_references(html: str) -> list[str]:
+        """
+        Same as get_references, on the source of the page.
+        """
+        parser = _BibItemParser()
+        parser.feed(html)
+        parser.close()
         ret = []
-        while True:
-            ref = ArXiv._get_reference(browser, id)
-            if ref is None:
-                break
+        id = 1
+        while id in parser.items:
+            # like export_reference of arxiv.js: drop the first child
+            # node (the [n] tag) and join the others with spaces.
+            children = parser.items[id][1:]
+            ref = ' '.join(children).replace('\n', ' ').replace('↑', ';', 1).strip()
             if ref != '':
                 ret.append(ref)
             id += 1
         return ret
 
+    @staticmethod
+    def fetch_references(article_id: str, session: requests.Session | None = None) -> list[str]:
+        """
+        References of the article, without a browser.
+        """
+        session = _session() if session is None else session
+        with metrics.timer('http.fetch', metrics.domain(ARXIV_HTML)) as event:
+            res = session.get(ARXIV_HTML + article_id, timeout=TIMEOUT)
+            res.raise_for_status()
+            event['bytes'] = len(res.content)
+        return ArXiv.parse_references(res.text)
+
+
+class _BibItemParser(HTMLParser):
+    """
+    Collect the text content of each child node of the `#bib.bibN` elements.
+    """
+    _ID = re.compile(r'^bib\.bib(\d+)$')
+    _VOID = {'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input',
+             'link', 'meta', 'source', 'track', 'wbr'}
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.items: dict[int, list[str]] = dict()
+        self.children: list[str] | None = None
+        self.depth = 0
+        self.text_child = False
+
+    def handle_starttag(self, tag, attrs):
+        if self.children is None:
+            m = _BibItemParser._ID.match(dict(attrs).get('id', None) or '')
+            if m is not None and tag not in _BibItemParser._VOID:
+                self.children = []
+                self.items[int(m.group(1))] = self.children
+                self.depth = 0
+                self.text_child = False
+            return
+        if self.depth == 0:
+            self.children.append('')
+            self.text_child = False
+        if tag not in _BibItemParser._VOID:
+            self.depth += 1
+
+    def handle_startendtag(self, tag, attrs):
+        if self.children is not None and self.depth == 0:
+            self.children.append('')
+            self.text_child = False
+
+    def handle_endtag(self, tag):
+        if self.children is None or tag in _BibItemParser._VOID:
+            return
+        if self.depth == 0:
+            self.children = None
+            return
+        self.depth -= 1
+
+    def handle_data(self, data):
+        if self.children is None:
+            return
+        if self.depth == 0 and not self.text_child:
+            self.children.append('')
+            self.text_child = True
+        self.children[-1] += data
+
+
+_http: requests.Session | None = None
+
+
+def _session() -> requests.Session:
+    """
+    One keep-alive session per process.
+    """
+    global _http
+    if _http is None:
+        _http = requests.Session()
+    return _http
+
+
+def fetch(article_id: str) -> list[str] | None:
+    """
+    :return: references of the article, None on error.
+    """
+    try:
+        return ArXiv.fetch_references(article_id)
+    except Exception as e:
+        print(f"{article_id}: {e}", file=sys.stderr)
+        return None
+
+
+def scrape(pool: BrowserPool, article_id: str) -> list[str] | None:
+    """
+    :return: references of the article, None on error.
+    """
+    url = ARXIV_HTML + article_id
+    try:
+        with pool.lease() as browser:
+            with metrics.timer('page.load', metrics.domain(url)):
+                browser.get(url)
+            return ArXiv.get_references(browser)
+    except Exception as e:
+        print(e, file=sys.stderr)
+        return None
+
+
+def fetch_or_scrape(pool: BrowserPool, article_id: str, delay: float) -> list[str] | None:
+    """
+    Read the references over HTTP, falling back to the browser
+    if there are none.
+
+    :return: references of the article, None on error.
+    """
+    references = fetch(article_id)
+    if references:
+        return references
+    # the same domain again: keep the politeness delay.
+    time.sleep(delay)
+    return scrape(pool, article_id)
+
+
 if __name__ == "__main__":
-    myoptions = Options()
-    myoptions.add_argument("-headless") # Enable headless mode
+    pool = BrowserPool(headless_firefox)
 
     bibfile = os.path.join("..", "dataset", "arxiv.bib")
-    lib = bibtexparser.load(open(bibfile, 'r'));
+    lib = bibload.load(bibfile)
     logfile = open("arxiv.log", 'w')
     reffile = open("arxiv.txt", 'w')
+    pagefile = open("arxiv.jsonl", 'w', encoding='utf-8')
+
+    try:
+        entries = {entry['eprint']: entry for entry in lib.entries if 'eprint' in entry}
+        per_domain = int(os.environ.get('PER_DOMAIN', '4'))
+        delay = float(os.environ.get('DELAY', '1'))
+        domain = domain_name(ARXIV_HTML)
+        tasks = [(domain, article_id) for article_id in entries]
+        for article_id, references in scheduled_as_completed(
+                lambda i: fetch_or_scrape(pool, i, delay), tasks, per_domain, per_domain, delay):
+            print(article_id, file=sys.stderr)
+            if references is None:
+                logfile.write(f"Error: {article_id}\n")
+                references = []
+            else:
+                pagefile.write(page_record(entries[article_id], references) + "\n")
+                pagefile.flush()
+
+            for ref in references:
+                reffile.write(ref + "\n")
+            if len(references) == 0:
+                logfile.write(f"No reference: {article_id}\n")
 
-    for entry in lib.entries:
-        if 'eprint' not in entry:
-            continue
-        article_id  = entry['eprint']
-        print(article_id, file=sys.stderr)
-        url = 'https://arxiv.org/html/' + article_id
-        browser = webdriver.Firefox(options=myoptions)
-        references = []
-        try:
-            browser.get(url)
-            references = ArXiv.get_references(browser)
-        except:
-            logfile.write(f"Error: {article_id}\n")
-        browser.quit()
-
-        for ref in references:
-            reffile.write(ref + "\n")
-        if len(references) == 0:
-            logfile.write(f"No reference: {article_id}\n")
-
-        reffile.flush()
-        time.sleep(1)
-        del references
-        del browser
+            logfile.flush()
+            reffile.flush()
+            del references
+    finally:
+        pool.close()
 
     logfile.close()
+    pagefile.close()
     reffile.close()
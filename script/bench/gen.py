@@ -0,0 +1,125 @@
+"""
+SYNOPSIS
+    gen.py bib <n> <output.bib>
+    gen.py refs <n> <output.txt>
+    gen.py site <seeds> <dir> <base url>
+
+DESCRIPTION
+    Synthetic inputs for the benchmarks, reproducible (fixed seed).
+
+    bib writes n bibtex entries; refs writes n reference strings,
+    about a third of them the same paper formatted by another
+    publisher (as dedup.py sees them).
+
+    site writes, for a static server at base url:
+        dir/html/<id>          arXiv html pages, 50 references each
+        dir/pdf/<key>.pdf      one 256 KiB pdf per seed
+        dir/dataset/arxiv.bib  the seeds, with their eprint
+        dir/papers.bib         the seeds, with the url of their pdf
+"""
+import os
+import random
+import sys
+from html import escape
+
+WORDS = ('automated program repair large language model neural bug fix patch '
+         'generation fault localization test code defect vulnerability learning '
+         'empirical study benchmark dataset deep transformer static analysis '
+         'debugging synthesis search based mutation semantic repository').split()
+NAMES = ('Smith Zhang Wang Li Chen Garcia Muller Rossi Tanaka Kim Singh Brown '
+         'Dupont Silva Novak Jensen').split()
+VENUES = ['In Proceedings of the IEEE/ACM International Conference on Software Engineering',
+          'ACM Transactions on Software Engineering and Methodology',
+          'Empirical Software Engineering',
+          'arXiv preprint']
+
+
+def title(rng: random.Random) -> str:
+    return ' '.join(rng.choice(WORDS) for _ in range(rng.randint(5, 11))).capitalize()
+
+
+def authors(rng: random.Random) -> list[str]:
+    return [f"{rng.choice('ABCDEFGHJKLMNPRSTW')}. {rng.choice(NAMES)}"
+            for _ in range(rng.randint(1, 5))]
+
+
+def reference(rng: random.Random, paper: tuple, style: int) -> str:
+    t, a, year, venue = paper
+    if style == 0:
+        return f"{', '.join(a)}. {year}. {t}. {venue}, {rng.randint(1, 900)}-{rng.randint(901, 999)}."
+    if style == 1:
+        return f"{', '.join(x.split()[-1] + ' ' + x.split()[0] for x in a)} ({year}) {t}. {venue}"
+    return f"{' and '.join(a)}. {t}. {venue}, {year}."
+
+
+def papers(rng: random.Random, n: int) -> list[tuple]:
+    return [(title(rng), authors(rng), rng.randint(1995, 2025), rng.choice(VENUES))
+            for _ in range(n)]
+
+
+def write_bib(n: int, ofile: str, url=None, eprint=None) -> None:
+    """
+    :param: url: url(i) of the i-th entry, default a doi.org link.
+    :param: eprint: eprint(i) of the i-th entry.
+    """
+    rng = random.Random(n)
+    with open(ofile, 'w', encoding='utf-8') as fobj:
+        for i, (t, a, year, venue) in enumerate(papers(rng, n)):
+            fobj.write(f"@article{{key{i},\n"
+                       f" author = {{{' and '.join(a)}}},\n"
+                       f" title = {{{t}}},\n"
+                       f" journal = {{{venue}}},\n"
+                       f" year = {{{year}}},\n"
+                       f" doi = {{10.5555/{i}}},\n"
+                       f" eprint = {{{eprint(i) if eprint else f'{2000 + i // 10000}.{i % 10000:05d}'}}},\n"
+                       f" url = {{{url(i) if url else f'https://doi.org/10.5555/{i}'}}}\n"
+                       f"}}\n\n")
+
+
+def write_refs(n: int, ofile: str) -> None:
+    rng = random.Random(n)
+    pool = papers(rng, max(1, n * 2 // 3))
+    with open(ofile, 'w', encoding='utf-8') as fobj:
+        for i in range(n):
+            paper = pool[i] if i < len(pool) else rng.choice(pool)
+            fobj.write(reference(rng, paper, rng.randrange(3)) + '\n')
+
+
+def write_site(seeds: int, root: str, base_url: str, refs_per_page: int = 50,
+               pdf_size: int = 256 << 10) -> None:
+    rng = random.Random(seeds)
+    pool = papers(rng, seeds * refs_per_page // 3 + 1)
+    for sub in ('html', 'pdf', 'dataset'):
+        os.makedirs(os.path.join(root, sub), exist_ok=True)
+    for i in range(seeds):
+        article_id = f"2401.{i:05d}"
+        with open(os.path.join(root, 'html', article_id), 'w', encoding='utf-8') as fobj:
+            fobj.write(f"<html><head><title>{article_id}</title></head><body>\n"
+                       f"<section class=\"ltx_bibliography\"><ul>\n")
+            for j in range(1, refs_per_page + 1):
+                ref = escape(reference(rng, rng.choice(pool), rng.randrange(3)))
+                fobj.write(f"<li id=\"bib.bib{j}\" class=\"ltx_bibitem\">"
+                           f"<span class=\"ltx_tag\">[{j}]</span>"
+                           f"<span class=\"ltx_bibblock\">{ref}</span></li>\n")
+            fobj.write("</ul></section></body></html>\n")
+        with open(os.path.join(root, 'pdf', f"key{i}.pdf"), 'wb') as fobj:
+            fobj.write(b'%PDF-1.4\n' + rng.randbytes(pdf_size))
+    write_bib(seeds, os.path.join(root, 'dataset', 'arxiv.bib'),
+              eprint=lambda i: f"2401.{i:05d}")
+    write_bib(seeds, os.path.join(root, 'papers.bib'),
+              lambda i: f"{base_url.rstrip('/')}/pdf/key{i}.pdf")
+
+
+if __name__ == "__main__":
+    args = sys.argv
+    if len(args) == 4 and args[1] == 'bib':
+        write_bib(int(args[2]), args[3])
+    elif len(args) == 4 and args[1] == 'refs':
+        write_refs(int(args[2]), args[3])
+    elif len(args) == 5 and args[1] == 'site':
+        write_site(int(args[2]), args[3], args[4])
+    else:
+        print("Usage: gen.py bib <n> <output.bib>", file=sys.stderr)
+        print("       gen.py refs <n> <output.txt>", file=sys.stderr)
+        print("       gen.py site <seeds> <dir> <base url>", file=sys.stderr)
+        sys.exit(1)
@@ -0,0 +1,160 @@
+"""
+SYNOPSIS
+    mockllm.py [port]
+
+DESCRIPTION
+    Local stand-in for an OpenAI-compatible chat completion API
+    (POST /v1/chat/completions), answering the prompts of snowball.py
+    with a made-up Article (or a json array of them for a batched
+    prompt) after a configurable delay, and rejecting some requests
+    with HTTP 429 like a rate-limited provider.
+
+    Use BASE_URL=http://127.0.0.1:<port>/v1 with any API_KEY and MODEL.
+
+ENVIRONMENT
+    LATENCY: seconds before answering (default: 0.2)
+    JITTER: the latency varies uniformly by up to that fraction (default: 0.5)
+    RATE_429: fraction of requests rejected at random (default: 0)
+    RPM_LIMIT: reject requests above that many per minute (default: 0, no limit)
+"""
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+import zlib
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+CATEGORIES = ['technical', 'survey', 'benchmark', 'irrelevant', 'irrelevant', 'irrelevant']
+
+_SINGLE = re.compile(r'extracted from paper:\n(.*?)\n\n', re.DOTALL)
+_BATCH_ITEM = re.compile(r'^\[(\d+)\] (.*)$', re.MULTILINE)
+_BATCH_SIZE = re.compile(r'json array of exactly (\d+) elements')
+
+
+def article(reference: str) -> dict:
+    """
+    A deterministic answer for reference.
+    """
+    h = zlib.crc32(reference.encode('utf-8'))
+    parts = [p.strip() for p in reference.split('. ') if len(p.split()) >= 3]
+    return {
+        'title': max(parts, key=len) if parts else reference.strip(),
+        'authors': [],
+        'year': 2000 + h % 25,
+        'category': CATEGORIES[h % len(CATEGORIES)],
+    }
+
+
+def answer(prompt: str) -> str:
+    m = _BATCH_SIZE.search(prompt)
+    if m is not None:
+        items = [item for _, item in _BATCH_ITEM.findall(prompt)][:int(m.group(1))]
+        return json.dumps([article(item) for item in items])
+    m = _SINGLE.search(prompt)
+    return json.dumps(article(m.group(1) if m is not None else prompt))
+
+
+class Limits():
+    def __init__(self, latency: float, jitter: float, rate_429: float, rpm_limit: int):
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_429 = rate_429
+        self.rpm_limit = rpm_limit
+        self.recent: deque[float] = deque()
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.rejected = 0
+
+    def admit(self) -> bool:
+        now = time.monotonic()
+        with self.lock:
+            self.requests += 1
+            while self.recent and self.recent[0] < now - 60:
+                self.recent.popleft()
+            if random.random() < self.rate_429 or \
+                    (self.rpm_limit > 0 and len(self.recent) >= self.rpm_limit):
+                self.rejected += 1
+                return False
+            self.recent.append(now)
+            return True
+
+    def delay(self) -> float:
+        return self.latency * (1 + self.jitter * (2 * random.random() - 1))
+
+
+def make_handler(limits: Limits):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def _send(self, status: int, obj: dict, headers: dict | None = None):
+            body = json.dumps(obj).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            for k, v in (headers or {}).items():
+                self.send_header(k, v)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_POST(self):
+            request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+            if not self.path.endswith('/chat/completions'):
+                self._send(404, {'error': {'message': 'not found'}})
+                return
+            if not limits.admit():
+                self._send(429, {'error': {'message': 'rate limit exceeded',
+                                           'type': 'rate_limit_error'}},
+                           {'retry-after-ms': '200'})
+                return
+            time.sleep(limits.delay())
+            prompt = request['messages'][-1]['content']
+            content = answer(prompt)
+            prompt_tokens = sum(len(m['content']) // 4 + 1 for m in request['messages'])
+            completion_tokens = len(content) // 4 + 1
+            self._send(200, {
+                'id': 'chatcmpl-mock',
+                'object': 'chat.completion',
+                'created': int(time.time()),
+                'model': request.get('model', 'mock'),
+                'choices': [{'index': 0, 'finish_reason': 'stop',
+                             'message': {'role': 'assistant', 'content': content}}],
+                'usage': {'prompt_tokens': prompt_tokens,
+                          'completion_tokens': completion_tokens,
+                          'total_tokens': prompt_tokens + completion_tokens},
+            })
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def serve(port: int = 0, **kwargs) -> tuple[ThreadingHTTPServer, Limits]:
+    """
+    Start the server in a background thread.
+
+    :param: latency, jitter, rate_429, rpm_limit: default to the environment.
+    :return: the server (server.server_port is the port) and its limits.
+    """
+    limits = Limits(kwargs.get('latency', float(os.environ.get('LATENCY', '0.2'))),
+                    kwargs.get('jitter', float(os.environ.get('JITTER', '0.5'))),
+                    kwargs.get('rate_429', float(os.environ.get('RATE_429', '0'))),
+                    kwargs.get('rpm_limit', int(os.environ.get('RPM_LIMIT', '0'))))
+    server = ThreadingHTTPServer(('127.0.0.1', port), make_handler(limits))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, limits
+
+
+if __name__ == "__main__":
+    server, limits = serve(int(sys.argv[1]) if len(sys.argv) > 1 else 8000)
+    print(f"BASE_URL=http://127.0.0.1:{server.server_port}/v1", file=sys.stderr)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        print(f"{limits.requests} requests, {limits.rejected} rejected", file=sys.stderr)
@@ -0,0 +1,164 @@
+"""
+SYNOPSIS
+    run.py [scale]
+
+DESCRIPTION
+    Benchmark the scripts offline: generate synthetic inputs, start
+    the mock chat model (mockllm.py) and a static server (static.py)
+    on localhost, run each script in a subprocess against them, and
+    report items/s, the p50/p95/p99 latency and failure rate of its
+    main step (from its METRICS events) and its peak RSS.
+
+        snowball   classify references with the mock chat model
+        dedup      cluster the same references
+        bibload    parse a large bib file (cold cache, then warm)
+        arxiv      extract references of the seeds from static pages
+        citegraph  ingest the pages written by arxiv
+        download   download the pdfs of the seeds
+
+    scale multiplies the sizes of the inputs (default: 1, i.e. 2000
+    references, 20000 bib entries, 200 seeds). The browser-driven
+    scrapers (acm.py, springer.py, scholar.py) are not run; saved pages
+    can still be served to them with static.py.
+
+ENVIRONMENT
+    LATENCY, JITTER, RATE_429, RPM_LIMIT: as in mockllm.py
+        (default here: 0.05 s latency, 2% of 429)
+    WORKERS: snowball.py workers (default: 16)
+    KEEP: set to 1 to keep the working directory
+"""
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+SCRIPT_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, SCRIPT_DIR)
+
+import bibload
+import gen
+import mockllm
+import static
+from metrics import percentile
+
+
+def run(name: str, argv: list[str], cwd: str, env: dict, items: int,
+        stage: str | None = None) -> dict:
+    """
+    Run argv to completion.
+
+    :param: stage: the metrics stage whose latency is reported.
+    """
+    events = os.path.join(cwd, f"{name}.events.jsonl")
+    if os.path.exists(events):
+        os.unlink(events)
+    env = {**os.environ, **env, 'METRICS': events}
+    with open(os.path.join(cwd, f"{name}.log"), 'w') as log:
+        start = time.perf_counter()
+        proc = subprocess.Popen([sys.executable] + argv, cwd=cwd, env=env,
+                                stdout=subprocess.DEVNULL, stderr=log)
+        _, status, usage = os.wait4(proc.pid, 0)
+        elapsed = time.perf_counter() - start
+    proc.returncode = os.waitstatus_to_exitcode(status)
+
+    latencies, failed = [], 0
+    if stage is not None and os.path.exists(events):
+        with open(events, 'r', encoding='utf-8') as fobj:
+            for line in fobj:
+                event = json.loads(line)
+                if event['stage'] == stage and 'secs' in event:
+                    latencies.append(event['secs'])
+                    failed += not event.get('ok', True)
+    return {
+        'name': name,
+        'status': proc.returncode,
+        'items': items,
+        'secs': elapsed,
+        'latencies': latencies,
+        'failed': failed,
+        # KiB on Linux
+        'rss': usage.ru_maxrss / 1024,
+    }
+
+
+def report(results: list[dict]) -> str:
+    lines = [f"{'bench':<16} {'items':>7} {'secs':>8} {'items/s':>9} "
+             f"{'p50':>8} {'p95':>8} {'p99':>8} {'failed':>7} {'RSS MiB':>8}"]
+    for r in results:
+        lat = r['latencies']
+        pcts = ' '.join(f"{percentile(lat, q) * 1000:>6.1f}ms" if lat else f"{'-':>8}"
+                        for q in (50, 95, 99))
+        failed = f"{r['failed'] / len(lat) * 100:>6.1f}%" if lat else f"{'-':>7}"
+        status = '' if r['status'] == 0 else f"  (exit {r['status']})"
+        lines.append(f"{r['name']:<16} {r['items']:>7} {r['secs']:>8.2f} "
+                     f"{r['items'] / r['secs']:>9.1f} {pcts} {failed} {r['rss']:>8.1f}{status}")
+    return '\n'.join(lines)
+
+
+def script(name: str) -> str:
+    return os.path.join(SCRIPT_DIR, name)
+
+
+if __name__ == "__main__":
+    scale = float(sys.argv[1]) if len(sys.argv) > 1 else 1.0
+    num_refs = int(2000 * scale)
+    num_entries = int(20000 * scale)
+    num_seeds = int(200 * scale)
+
+    root = tempfile.mkdtemp(prefix='snowball-bench-')
+    llm, limits = mockllm.serve(latency=float(os.environ.get('LATENCY', '0.05')),
+                                rate_429=float(os.environ.get('RATE_429', '0.02')))
+    site = os.path.join(root, 'site')
+    server = static.serve(site)
+    base_url = f"http://127.0.0.1:{server.server_port}/"
+
+    print(f"Generating inputs in {root}", file=sys.stderr)
+    refs = os.path.join(root, 'refs.txt')
+    bib = os.path.join(root, 'large.bib')
+    gen.write_refs(num_refs, refs)
+    gen.write_bib(num_entries, bib)
+    gen.write_site(num_seeds, site, base_url)
+    # arxiv.py reads ../dataset/arxiv.bib
+    work = os.path.join(site, 'work')
+    os.makedirs(work)
+    os.makedirs(os.path.join(root, 'pdfs'))
+
+    results = []
+    results.append(run('snowball', [script('snowball.py'), refs], root, {
+        'API_KEY': 'bench', 'MODEL': 'mock',
+        'BASE_URL': f"http://127.0.0.1:{llm.server_port}/v1",
+        'WORKERS': os.environ.get('WORKERS', '16'), 'RPM': '0',
+        'CACHE': '', 'CHECKPOINT': '',
+    }, num_refs, 'llm'))
+    results.append(run('dedup', [script('dedup.py'), refs], root, {}, num_refs))
+    results.append(run('bibload-cold', [script('bibload.py'), bib], root, {}, num_entries))
+    results.append(run('bibload-warm', [script('bibload.py'), bib], root, {}, num_entries))
+    results.append(run('arxiv', [script('arxiv.py')], work, {
+        'ARXIV_BASE_URL': base_url + 'html/', 'DELAY': '0', 'PER_DOMAIN': '8',
+    }, num_seeds, 'http.fetch'))
+    results.append(run('citegraph', [script('citegraph.py'), 'ingest',
+                                     os.path.join(root, 'bench.graph'),
+                                     os.path.join(work, 'arxiv.jsonl')],
+                       root, {}, num_seeds))
+    results.append(run('download', [script('download.py'), os.path.join(site, 'papers.bib'),
+                                     os.path.join(root, 'pdfs'), '8'],
+                       root, {'DELAY': '0', 'PER_DOMAIN': '8', 'BIBSTORE': ''}, num_seeds, 'download'))
+
+    print(report(results))
+    print(f"mock chat model: {limits.requests} requests, {limits.rejected} answered 429",
+          file=sys.stderr)
+
+    llm.shutdown()
+    server.shutdown()
+    for path in (bib, os.path.join(site, 'dataset', 'arxiv.bib'), os.path.join(site, 'papers.bib')):
+        cache = bibload._cache_file(path)
+        if os.path.exists(cache):
+            os.unlink(cache)
+    if os.environ.get('KEEP', '0') == '1':
+        print(f"Kept {root}", file=sys.stderr)
+    else:
+        shutil.rmtree(root)
@@ -0,0 +1,65 @@
+"""
+SYNOPSIS
+    static.py <dir> [port]
+
+DESCRIPTION
+    Serve the saved pages and pdfs of dir over HTTP, in place of
+    arXiv, Springer and ACM: e.g. dir/html/<id> for arxiv.py with
+    ARXIV_BASE_URL=http://127.0.0.1:<port>/html/, and dir/pdf/*.pdf
+    for download.py. Files are served as application/pdf or text/html
+    whatever their name, with Last-Modified for conditional requests.
+
+ENVIRONMENT
+    LATENCY: seconds before answering each request (default: 0)
+"""
+import functools
+import os
+import sys
+import threading
+import time
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+
+class Handler(SimpleHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    latency = 0.0
+
+    def guess_type(self, path):
+        return 'application/pdf' if path.endswith('.pdf') else 'text/html; charset=utf-8'
+
+    def send_head(self):
+        if self.latency > 0:
+            time.sleep(self.latency)
+        return super().send_head()
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(root: str, port: int = 0, latency: float | None = None) -> ThreadingHTTPServer:
+    """
+    Start the server in a background thread.
+
+    :return: the server (server.server_port is the port).
+    """
+    handler = type('Handler', (Handler,), {
+        'latency': latency if latency is not None else float(os.environ.get('LATENCY', '0')),
+    })
+    server = ThreadingHTTPServer(('127.0.0.1', port), functools.partial(handler, directory=root))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    args = sys.argv
+    if len(args) not in (2, 3):
+        print("Usage: static.py <dir> [port]", file=sys.stderr)
+        sys.exit(1)
+    server = serve(args[1], int(args[2]) if len(args) == 3 else 8001)
+    print(f"http://127.0.0.1:{server.server_port}/", file=sys.stderr)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,173 @@
+"""
+SYNOPSIS
+    bibload.py <bibfile>...
+
+DESCRIPTION
+    Bibtex loading shared by the scripts.
+
+    Parsed entries are cached in .bibcache/ (next to this file), and
+    reused as long as the bib file keeps the same mtime and size, or
+    the same sha256 once touched; an unreadable cache file is removed
+    and the bib file parsed again. Files missing from the cache are
+    parsed in parallel, one process per file. iter_entries() yields
+    entries one at a time, without building the whole BibDatabase.
+
+    When run, it (re)builds the cache of the given files.
+"""
+import hashlib
+import os
+import pickle
+import sys
+import bibtexparser
+from bibtexparser.bibdatabase import BibDatabase
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterator
+
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.bibcache')
+
+
+def _cache_file(path: str) -> str:
+    key = hashlib.sha1(os.path.abspath(path).encode('utf-8')).hexdigest()
+    return os.path.join(CACHE_DIR, key + '.pickle')
+
+
+def _sha256(path: str) -> str:
+    sha = hashlib.sha256()
+    with open(path, 'rb') as fobj:
+        for chunk in iter(lambda: fobj.read(1 << 16), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def _cached(path: str) -> list[dict] | None:
+    """
+    :return: cached entries of path, None if missing or stale.
+        A cache file that cannot be read (truncated, corrupt, or
+        written by an incompatible version) is removed.
+    """
+    cache = _cache_file(path)
+    if not os.path.exists(cache):
+        return None
+    try:
+        with open(cache, 'rb') as fobj:
+            obj = pickle.load(fobj)
+        mtime, size, sha256, entries = obj['mtime'], obj['size'], obj['sha256'], obj['entries']
+    except (pickle.UnpicklingError, EOFError, AttributeError, ImportError,
+            IndexError, KeyError, TypeError, ValueError) as e:
+        print(f"Ignoring broken cache of {path}: {e!r}", file=sys.stderr)
+        try:
+            os.unlink(cache)
+        except FileNotFoundError:
+            pass
+        return None
+    st = os.stat(path)
+    if mtime == st.st_mtime_ns and size == st.st_size:
+        return entries
+    if size != st.st_size or sha256 != _sha256(path):
+        return None
+    # touched but unchanged: remember the new mtime.
+    _store(path, entries, st, sha256)
+    return entries
+
+
+def _store(path: str, entries: list[dict], st: os.stat_result, sha256: str) -> None:
+    """
+    :param: st, sha256: stat and hash of the content entries were
+        parsed from, taken before parsing.
+    """
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    cache = _cache_file(path)
+    tmp = f"{cache}.{os.getpid()}.tmp"
+    with open(tmp, 'wb') as fobj:
+        pickle.dump({
+            'mtime': st.st_mtime_ns,
+            'size': st.st_size,
+            'sha256': sha256,
+            'entries': entries,
+        }, fobj, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp, cache)
+
+
+def _parse(path: str) -> list[dict]:
+    # stat first and hash the very bytes parsed: if the file is edited
+    # meanwhile, the cache is stale at the next load instead of wrong.
+    st = os.stat(path)
+    with open(path, 'rb') as fobj:
+        data = fobj.read()
+    # newlines translated as when reading in text mode.
+    text = data.decode('utf-8').replace('\r\n', '\n').replace('\r', '\n')
+    entries = bibtexparser.loads(text).entries
+    _store(path, entries, st, hashlib.sha256(data).hexdigest())
+    return entries
+
+
+def _database(entries: list[dict]) -> BibDatabase:
+    lib = BibDatabase()
+    lib.entries = entries
+    return lib
+
+
+def load(path: str) -> BibDatabase:
+    """
+    Drop-in replacement of bibtexparser.load(open(path)).
+    """
+    entries = _cached(path)
+    if entries is None:
+        entries = _parse(path)
+    return _database(entries)
+
+
+def load_many(paths: list[str], processes: int | None = None) -> list[BibDatabase]:
+    """
+    Load several bib files, parsing the uncached ones in parallel.
+    """
+    entries = [_cached(path) for path in paths]
+    missing = [path for path, e in zip(paths, entries) if e is None]
+    if len(missing) > 1:
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            parsed = dict(zip(missing, executor.map(_parse, missing)))
+    else:
+        parsed = {path: _parse(path) for path in missing}
+    return [_database(e if e is not None else parsed[path])
+            for path, e in zip(paths, entries)]
+
+
+def iter_entries(path: str, fields: set[str] | None = None) -> Iterator[dict]:
+    """
+    Yield the entries of path one at a time, parsing one entry
+    per call to bibtexparser (so @string macros are not shared
+    between entries).
+
+    :param: fields: if given, only keep these fields (with ID and ENTRYTYPE).
+    """
+    def _entries(chunk: list[str]):
+        if len(chunk) == 0:
+            return
+        for entry in bibtexparser.loads(''.join(chunk)).entries:
+            if fields is not None:
+                entry = {k: v for k, v in entry.items()
+                         if k in fields or k in ('ID', 'ENTRYTYPE')}
+            yield entry
+
+    chunk: list[str] = []
+    depth = 0
+    with open(path, 'r', encoding='utf-8') as fobj:
+        for line in fobj:
+            if depth <= 0 and line.lstrip().startswith('@'):
+                yield from _entries(chunk)
+                chunk = []
+                depth = 0
+            chunk.append(line)
+            depth += line.count('{') - line.count('\\{') \
+                - line.count('}') + line.count('\\}')
+    yield from _entries(chunk)
+
+
+if __name__ == "__main__":
+    args = sys.argv
+    if len(args) < 2:
+        print("Usage: bibload.py <bibfile>...", file=sys.stderr)
+        sys.exit(1)
+
+    for path, lib in zip(args[1:], load_many(args[1:])):
+        print(f"{path}: {len(lib.entries)} entries", file=sys.stderr)
@@ -0,0 +1,212 @@
+"""
+SYNOPSIS
+    bibstore.py sync
+    bibstore.py lookup <id|doi|eprint|url|title> <value>
+    bibstore.py export <output.bib> [path-substring]
+
+DESCRIPTION
+    SQLite store of all entries in ../dataset/*.bib and ../bibtex/*.bib,
+    indexed on ID, DOI, arXiv eprint, URL and normalized title, so
+    that the scripts can ask whether an article is already collected
+    without parsing the bib files.
+
+    sync re-imports only the bib files whose content changed since
+    the last sync, and forgets deleted ones. export writes the
+    entries (optionally of matching files only) back to bibtex.
+
+ENVIRONMENT
+    BIBSTORE: the sqlite file (default: bibstore.sqlite next to this file)
+
+SEE ALSO
+    bibload.py(1)
+    titleindex.py(1)
+    download.py(1)
+"""
+import json
+import os
+import sqlite3
+import sys
+import bibtexparser
+from bibtexparser.bibdatabase import BibDatabase
+
+import bibload
+from titleindex import default_bibfiles, normalize_title
+
+DEFAULT_STORE = os.environ.get('BIBSTORE', os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), 'bibstore.sqlite'))
+
+
+def normalize_doi(doi: str) -> str:
+    doi = doi.strip().lower()
+    for prefix in ('https://doi.org/', 'http://doi.org/', 'https://dx.doi.org/', 'doi:'):
+        if doi.startswith(prefix):
+            doi = doi[len(prefix):]
+    return doi
+
+
+def normalize_url(url: str) -> str:
+    return url.strip().rstrip('/')
+
+
+class BibStore():
+    COLUMNS = {
+        'id': 'key',
+        'doi': 'doi',
+        'eprint': 'eprint',
+        'url': 'url',
+        'title': 'title',
+    }
+
+    def __init__(self, path: str = DEFAULT_STORE):
+        self.db = sqlite3.connect(path)
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS files (
+                path TEXT PRIMARY KEY,
+                mtime INTEGER NOT NULL,
+                size INTEGER NOT NULL,
+                sha256 TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS entries (
+                file TEXT NOT NULL,
+                key TEXT NOT NULL,
+                doi TEXT,
+                eprint TEXT,
+                url TEXT,
+                title TEXT,
+                data TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS entries_file ON entries(file);
+            CREATE INDEX IF NOT EXISTS entries_key ON entries(key);
+            CREATE INDEX IF NOT EXISTS entries_doi ON entries(doi);
+            CREATE INDEX IF NOT EXISTS entries_eprint ON entries(eprint);
+            CREATE INDEX IF NOT EXISTS entries_url ON entries(url);
+            CREATE INDEX IF NOT EXISTS entries_title ON entries(title);
+        """)
+        self.db.commit()
+
+    def _changed(self, path: str) -> tuple[bool, str | None]:
+        """
+        :return: whether path must be imported again, and its sha256
+            if it was computed.
+        """
+        row = self.db.execute("SELECT mtime, size, sha256 FROM files WHERE path = ?",
+                              (path,)).fetchone()
+        st = os.stat(path)
+        if row is not None and row[0] == st.st_mtime_ns and row[1] == st.st_size:
+            return False, row[2]
+        sha256 = bibload._sha256(path)
+        if row is not None and row[1] == st.st_size and row[2] == sha256:
+            self.db.execute("UPDATE files SET mtime = ? WHERE path = ?",
+                            (st.st_mtime_ns, path))
+            return False, sha256
+        return True, sha256
+
+    def upsert_file(self, path: str, sha256: str | None = None) -> int:
+        """
+        Replace the entries of path by its current content.
+
+        :return: the number of entries imported.
+        """
+        entries = bibload.load(path).entries
+        st = os.stat(path)
+        with self.db:
+            self.db.execute("DELETE FROM entries WHERE file = ?", (path,))
+            self.db.executemany("INSERT INTO entries VALUES (?, ?, ?, ?, ?, ?, ?)", [(
+                path,
+                entry.get('ID', ''),
+                normalize_doi(entry['doi']) if 'doi' in entry else None,
+                entry.get('eprint', None),
+                normalize_url(entry['url']) if 'url' in entry else None,
+                normalize_title(entry['title']) if 'title' in entry else None,
+                json.dumps(entry),
+            ) for entry in entries])
+            self.db.execute("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?)", (
+                path, st.st_mtime_ns, st.st_size,
+                bibload._sha256(path) if sha256 is None else sha256))
+        return len(entries)
+
+    def sync(self, paths: list[str] | None = None) -> None:
+        """
+        Import the changed bib files among paths, and forget the
+        files of the store missing from paths.
+        """
+        paths = [os.path.abspath(p) for p in (default_bibfiles() if paths is None else paths)]
+        for (path,) in self.db.execute("SELECT path FROM files").fetchall():
+            if path not in paths:
+                with self.db:
+                    self.db.execute("DELETE FROM entries WHERE file = ?", (path,))
+                    self.db.execute("DELETE FROM files WHERE path = ?", (path,))
+                print(f"{path}: removed", file=sys.stderr)
+        for path in paths:
+            changed, sha256 = self._changed(path)
+            if changed:
+                count = self.upsert_file(path, sha256)
+                print(f"{path}: {count} entries", file=sys.stderr)
+        self.db.commit()
+
+    def lookup(self, column: str, value: str) -> list[dict]:
+        """
+        :param: column: one of id, doi, eprint, url, title.
+        """
+        if column == 'doi':
+            value = normalize_doi(value)
+        elif column == 'url':
+            value = normalize_url(value)
+        elif column == 'title':
+            value = normalize_title(value)
+        rows = self.db.execute(
+            f"SELECT data FROM entries WHERE {BibStore.COLUMNS[column]} = ?", (value,))
+        return [json.loads(row[0]) for row in rows]
+
+    def by_id(self, key: str) -> list[dict]:
+        return self.lookup('id', key)
+
+    def by_doi(self, doi: str) -> list[dict]:
+        return self.lookup('doi', doi)
+
+    def by_eprint(self, eprint: str) -> list[dict]:
+        return self.lookup('eprint', eprint)
+
+    def by_url(self, url: str) -> list[dict]:
+        return self.lookup('url', url)
+
+    def by_title(self, title: str) -> list[dict]:
+        return self.lookup('title', title)
+
+    def export(self, ofile: str, file_pattern: str = '') -> int:
+        """
+        Write the entries of the files whose path contains file_pattern.
+
+        :return: the number of entries written.
+        """
+        rows = self.db.execute("SELECT data FROM entries WHERE instr(file, ?) > 0 "
+                               "ORDER BY file, rowid", (file_pattern,))
+        biblib = BibDatabase()
+        biblib.entries = [json.loads(row[0]) for row in rows]
+        with open(ofile, 'w', encoding='utf-8') as fobj:
+            fobj.write(bibtexparser.dumps(biblib))
+        return len(biblib.entries)
+
+    def close(self) -> None:
+        self.db.close()
+
+
+if __name__ == "__main__":
+    args = sys.argv
+    if len(args) == 2 and args[1] == 'sync':
+        store = BibStore()
+        store.sync()
+    elif len(args) == 4 and args[1] == 'lookup' and args[2] in BibStore.COLUMNS:
+        store = BibStore()
+        for entry in store.lookup(args[2], args[3]):
+            print(json.dumps(entry, ensure_ascii=False))
+    elif len(args) in (3, 4) and args[1] == 'export':
+        store = BibStore()
+        count = store.export(args[2], args[3] if len(args) == 4 else '')
+        print(f"{count} entries written to {args[2]}", file=sys.stderr)
+    else:
+        print("Usage: bibstore.py sync", file=sys.stderr)
+        print("       bibstore.py lookup <id|doi|eprint|url|title> <value>", file=sys.stderr)
+        print("       bibstore.py export <output.bib> [path-substring]", file=sys.stderr)
+        sys.exit(1)
+    store.close()
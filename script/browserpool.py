@@ -0,0 +1,154 @@
+"""
+DESCRIPTION
+    A pool of warm browsers shared by the scrapers (acm.py,
+    springer.py, arxiv.py, scholar.py), so that a browser is not
+    started and quit for every single entry.
+
+    A browser is reused for up to PAGES_PER_BROWSER entries, then
+    quit and replaced by a fresh one; a browser that raised an error
+    is replaced at once.
+
+    js_lib() loads the script run in the pages of a site, after
+    common.js (helpers shared by all sites).
+
+ENVIRONMENT
+    BROWSERS: number of browsers kept alive (default: 2)
+    PAGES_PER_BROWSER: recycle a browser after that many entries (default: 50)
+"""
+import functools
+import os
+import sys
+import threading
+from contextlib import contextmanager
+from typing import Callable
+
+import metrics
+
+
+@functools.cache
+def js_lib(name: str) -> str:
+    """
+    :return: common.js followed by the script name, both next to this file.
+    """
+    source = ''
+    for fname in ('common.js', name):
+        with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), fname),
+                  'r', encoding='utf-8') as f:
+            source += f.read() + '\n'
+    return source
+
+
+class BrowserPool():
+    def __init__(self, factory: Callable, size: int | None = None,
+                 max_pages: int | None = None):
+        """
+        :param: factory: starts a new browser.
+        :param: size: max number of live browsers.
+        :param: max_pages: number of leases before a browser is recycled.
+        """
+        self.factory = factory
+        self.size = size if size is not None else int(os.environ.get('BROWSERS', '2'))
+        self.max_pages = max_pages if max_pages is not None \
+            else int(os.environ.get('PAGES_PER_BROWSER', '50'))
+        self.idle: list = []
+        self.pages: dict[int, int] = dict()
+        # every live browser, idle or leased, to quit them all on close.
+        self.browsers: dict[int, object] = dict()
+        self.closed = False
+        self.live = 0
+        self.cond = threading.Condition()
+
+    def acquire(self):
+        """
+        Take an idle browser, starting one if fewer than size are alive.
+        Blocks while all browsers are in use.
+        """
+        with self.cond:
+            while len(self.idle) == 0 and self.live >= self.size:
+                self.cond.wait()
+            if len(self.idle) > 0:
+                return self.idle.pop()
+            self.live += 1
+        try:
+            with metrics.timer('browser.launch', getattr(self.factory, '__name__', '')):
+                browser = self.factory()
+        except Exception:
+            with self.cond:
+                self.live -= 1
+                self.cond.notify()
+            raise
+        with self.cond:
+            self.pages[id(browser)] = 0
+            self.browsers[id(browser)] = browser
+        return browser
+
+    def release(self, browser, failed: bool = False) -> None:
+        """
+        Give browser back; it is quit instead if it failed or has
+        served max_pages entries.
+        """
+        with self.cond:
+            if id(browser) not in self.browsers:
+                # already quit by close()
+                return
+            self.pages[id(browser)] += 1
+            recycle = failed or self.closed or self.pages[id(browser)] >= self.max_pages
+            if not recycle:
+                self.idle.append(browser)
+                self.cond.notify()
+                return
+            del self.pages[id(browser)]
+            del self.browsers[id(browser)]
+        BrowserPool._quit(browser)
+        with self.cond:
+            self.live -= 1
+            self.cond.notify()
+
+    @contextmanager
+    def lease(self):
+        """
+        with pool.lease() as browser: ...
+        """
+        browser = self.acquire()
+        failed = True
+        try:
+            yield browser
+            failed = False
+        finally:
+            self.release(browser, failed)
+
+    def close(self) -> None:
+        """
+        Quit all browsers, including the leased ones, so that none is
+        left running when the script is interrupted.
+        """
+        with self.cond:
+            self.closed = True
+            browsers = list(self.browsers.values())
+            self.browsers.clear()
+            self.pages.clear()
+            self.idle = []
+            self.live -= len(browsers)
+            self.cond.notify_all()
+        for browser in browsers:
+            BrowserPool._quit(browser)
+
+    @staticmethod
+    def _quit(browser) -> None:
+        try:
+            browser.quit()
+        except Exception as e:
+            print(e, file=sys.stderr)
+
+
+def headless_firefox():
+    from selenium import webdriver
+    from selenium.webdriver.firefox.options import Options
+    myoptions = Options()
+    myoptions.add_argument("-headless") # Enable headless mode
+    return webdriver.Firefox(options=myoptions)
+
+
+def undetected_chrome():
+    from seleniumbase import Driver
+    return Driver(uc=True, headless=False)
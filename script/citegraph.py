@@ -0,0 +1,327 @@
+"""
+SYNOPSIS
+    citegraph.py ingest <graph> <file.jsonl>...
+    citegraph.py frontier <graph> [n]
+    citegraph.py hops <graph> <title> [k]
+
+DESCRIPTION
+    Citation graph of the snowballing, to decide what to crawl next.
+
+    ingest adds to graph (created if missing) the pages written by
+    acm.py, springer.py and arxiv.py (acm.jsonl etc.: a seed entry
+    with its references and citations) and the labels of snowball.py
+    (result.jsonl).
+
+    frontier lists the n papers not crawled yet, and not labelled
+    irrelevant, cited by the most crawled or relevant papers.
+
+    hops lists the papers at most k citations away from title.
+
+    Papers are interned by DOI and normalized title into integer ids;
+    edges are kept in flat integer arrays, and turned into compressed
+    adjacency arrays (CSR) in both directions for the queries.
+
+ENVIRONMENT
+    PROCESSES: number of processes parsing records (default: number of CPUs)
+
+SEE ALSO
+    snowball.py(1)
+    dedup.py(1)
+"""
+import heapq
+import json
+import os
+import pickle
+import re
+import sys
+from array import array
+from collections import deque
+from multiprocessing import Pool
+
+from bibstore import normalize_doi
+from dedup import title_part
+from titleindex import normalize_title
+
+_DOI = re.compile(r'\b10\.\d{4,9}/[^\s,;"]+')
+
+CRAWLED = 1
+RELEVANT = 2
+IRRELEVANT = 4
+
+
+def page_record(entry: dict, references: list[str] | None,
+                cited_by: list[str] | None = None) -> str:
+    """
+    JSON line linking the bib entry of a scraped page to its
+    references and citations, for citegraph.py ingest.
+    """
+    return json.dumps({
+        'title': entry.get('title', ''),
+        'doi': entry.get('doi', ''),
+        'references': references if references is not None else [],
+        'cited_by': cited_by if cited_by is not None else [],
+    }, ensure_ascii=False)
+
+
+def paper_keys(title: str = '', doi: str = '') -> list[str]:
+    """
+    Interning keys of a paper: its normalized DOI and title, the
+    title last.
+    """
+    keys = []
+    if doi:
+        keys.append('doi:' + normalize_doi(doi))
+    title = normalize_title(title) if title else ''
+    if title:
+        keys.append(title)
+    return keys
+
+
+def reference_keys(reference: str) -> list[str]:
+    """
+    Interning keys of a paper given by a raw reference string.
+    """
+    m = _DOI.search(reference)
+    return paper_keys(title_part(reference), m.group(0).rstrip('.') if m else '')
+
+
+def parse_record(line: str) -> tuple | None:
+    """
+    Parse a JSON line of a page (acm.jsonl etc.) or of a label
+    (result.jsonl) into interning keys.
+    """
+    if len(line.strip()) == 0:
+        return None
+    record = json.loads(line)
+    if not isinstance(record, dict):
+        return None
+    if 'references' in record:
+        return ('page', paper_keys(record.get('title', ''), record.get('doi', '')),
+                [reference_keys(ref) for ref in record['references']],
+                [reference_keys(ref) for ref in record.get('cited_by', [])])
+    if 'title' in record and 'category' in record:
+        return ('label', paper_keys(str(record['title'])), record['category'] != 'irrelevant')
+    return None
+
+
+def _csr(num_nodes: int, src: array, dst: array) -> tuple[array, array]:
+    """
+    :return: (offsets, targets): the distinct targets of node n are
+        targets[offsets[n]:offsets[n + 1]], sorted.
+    """
+    counts = array('q', bytes(8 * (num_nodes + 1)))
+    for s in src:
+        counts[s + 1] += 1
+    for n in range(num_nodes):
+        counts[n + 1] += counts[n]
+    pos = array('q', counts)
+    targets = array('i', bytes(4 * len(src)))
+    for s, d in zip(src, dst):
+        targets[pos[s]] = d
+        pos[s] += 1
+
+    # drop duplicated edges (the same page ingested twice, etc.)
+    offsets = array('q', bytes(8 * (num_nodes + 1)))
+    unique = array('i')
+    for n in range(num_nodes):
+        row = targets[counts[n]:counts[n + 1]]
+        if len(row) > 1:
+            row = array('i', sorted(set(row)))
+        unique.extend(row)
+        offsets[n + 1] = len(unique)
+    return offsets, unique
+
+
+class CitationGraph():
+    def __init__(self):
+        self.ids: dict[str, int] = dict()
+        self.labels: list[str] = []
+        self.flags = bytearray()
+        self.src = array('i')
+        self.dst = array('i')
+        self._out: tuple[array, array] | None = None
+        self._in: tuple[array, array] | None = None
+
+    def __len__(self) -> int:
+        return len(self.labels)
+
+    def intern(self, keys: list[str]) -> int:
+        """
+        :param: keys: from paper_keys().
+        :return: the id of the paper, -1 if keys is empty.
+        """
+        if len(keys) == 0:
+            return -1
+        ret = next((self.ids[k] for k in keys if k in self.ids), None)
+        if ret is None:
+            ret = len(self.labels)
+            self.labels.append(keys[-1])
+            self.flags.append(0)
+        for key in keys:
+            self.ids.setdefault(key, ret)
+        return ret
+
+    def node(self, title: str = '', doi: str = '') -> int:
+        """
+        Intern a paper by its DOI and title.
+        """
+        return self.intern(paper_keys(title, doi))
+
+    def lookup(self, title: str) -> int | None:
+        return self.ids.get(normalize_title(title), None)
+
+    def add_edge(self, citing: int, cited: int) -> None:
+        if citing < 0 or cited < 0 or citing == cited:
+            return
+        self.src.append(citing)
+        self.dst.append(cited)
+        self._out = self._in = None
+
+    def ingest(self, parsed: tuple | None) -> bool:
+        """
+        :param: parsed: from parse_record().
+        :return: whether it was a page or a label.
+        """
+        if parsed is None:
+            return False
+        if parsed[0] == 'page':
+            _, seed_keys, references, cited_by = parsed
+            seed = self.intern(seed_keys)
+            if seed < 0:
+                return True
+            self.flags[seed] |= CRAWLED
+            for keys in references:
+                self.add_edge(seed, self.intern(keys))
+            for keys in cited_by:
+                self.add_edge(self.intern(keys), seed)
+        else:
+            _, keys, relevant = parsed
+            n = self.intern(keys)
+            if n >= 0:
+                self.flags[n] &= ~(RELEVANT | IRRELEVANT)
+                self.flags[n] |= RELEVANT if relevant else IRRELEVANT
+        return True
+
+    def ingest_file(self, path: str, processes: int | None = None) -> int:
+        """
+        Ingest a JSONL file of pages or labels; records are parsed by
+        a pool of processes, and interned in order.
+
+        :return: the number of records ingested.
+        """
+        count = 0
+        with open(path, 'r', encoding='utf-8') as fobj, Pool(processes) as workers:
+            for parsed in workers.imap(parse_record, fobj, chunksize=64):
+                count += self.ingest(parsed)
+        return count
+
+    def out_edges(self) -> tuple[array, array]:
+        if self._out is None:
+            self._out = _csr(len(self), self.src, self.dst)
+        return self._out
+
+    def in_edges(self) -> tuple[array, array]:
+        if self._in is None:
+            self._in = _csr(len(self), self.dst, self.src)
+        return self._in
+
+    def neighbors(self, n: int, direction: str = 'out') -> array:
+        offsets, targets = self.out_edges() if direction == 'out' else self.in_edges()
+        return targets[offsets[n]:offsets[n + 1]]
+
+    def frontier(self, limit: int = 20) -> list[tuple[int, int]]:
+        """
+        Papers not crawled and not labelled irrelevant, ranked by
+        the number of crawled or relevant papers citing them.
+
+        :return: (node, score) pairs, best first.
+        """
+        offsets, citing = self.in_edges()
+        flags = self.flags
+
+        def candidates():
+            for n in range(len(self)):
+                if flags[n] & (CRAWLED | IRRELEVANT):
+                    continue
+                score = sum(1 for c in citing[offsets[n]:offsets[n + 1]]
+                            if flags[c] & (CRAWLED | RELEVANT))
+                if score > 0:
+                    yield n, score
+
+        return heapq.nlargest(limit, candidates(), key=lambda p: p[1])
+
+    def neighborhood(self, n: int, k: int, direction: str = 'both') -> dict[int, int]:
+        """
+        :param: direction: follow references ('out'), citations ('in') or both.
+        :return: node -> distance, for the nodes at most k hops from n.
+        """
+        directions = ('out', 'in') if direction == 'both' else (direction,)
+        dist = {n: 0}
+        queue = deque([n])
+        while queue:
+            cur = queue.popleft()
+            if dist[cur] >= k:
+                continue
+            for d in directions:
+                for other in self.neighbors(cur, d):
+                    if other not in dist:
+                        dist[other] = dist[cur] + 1
+                        queue.append(other)
+        return dist
+
+    def save(self, path: str) -> None:
+        tmp = path + '.tmp'
+        with open(tmp, 'wb') as fobj:
+            pickle.dump({
+                'ids': self.ids,
+                'labels': self.labels,
+                'flags': self.flags,
+                'src': self.src,
+                'dst': self.dst,
+            }, fobj, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, path)
+
+    @staticmethod
+    def load(path: str) -> 'CitationGraph':
+        with open(path, 'rb') as fobj:
+            obj = pickle.load(fobj)
+        ret = CitationGraph()
+        ret.ids = obj['ids']
+        ret.labels = obj['labels']
+        ret.flags = obj['flags']
+        ret.src = obj['src']
+        ret.dst = obj['dst']
+        return ret
+
+    def stats(self) -> str:
+        return f"{len(self)} papers, {len(self.src)} citations"
+
+
+if __name__ == "__main__":
+    args = sys.argv
+    if len(args) >= 4 and args[1] == 'ingest':
+        graph = CitationGraph.load(args[2]) if os.path.exists(args[2]) else CitationGraph()
+        processes = int(os.environ['PROCESSES']) if 'PROCESSES' in os.environ else None
+        for ifile in args[3:]:
+            count = graph.ingest_file(ifile, processes)
+            print(f"{ifile}: {count} records", file=sys.stderr)
+        graph.save(args[2])
+        print(graph.stats(), file=sys.stderr)
+    elif len(args) in (3, 4) and args[1] == 'frontier':
+        graph = CitationGraph.load(args[2])
+        for n, score in graph.frontier(int(args[3]) if len(args) == 4 else 20):
+            print(f"{score}\t{graph.labels[n]}")
+    elif len(args) in (4, 5) and args[1] == 'hops':
+        graph = CitationGraph.load(args[2])
+        n = graph.lookup(args[3])
+        if n is None:
+            print(f"{args[3]}: not in the graph", file=sys.stderr)
+            sys.exit(1)
+        dist = graph.neighborhood(n, int(args[4]) if len(args) == 5 else 1)
+        for other, d in sorted(dist.items(), key=lambda p: p[1]):
+            print(f"{d}\t{graph.labels[other]}")
+    else:
+        print("Usage: citegraph.py ingest <graph> <file.jsonl>...", file=sys.stderr)
+        print("       citegraph.py frontier <graph> [n]", file=sys.stderr)
+        print("       citegraph.py hops <graph> <title> [k]", file=sys.stderr)
+        sys.exit(1)
@@ -0,0 +1,14 @@
+// prepended to the script of each site by browserpool.js_lib().
+
+// metadata of the current page, shared by export_page of each site.
+var page_metadata = function () {
+    var meta = function (name) {
+        var elem = document.querySelector('meta[name="' + name + '"]');
+        return elem == null ? null : elem.getAttribute('content');
+    };
+    return {
+        url: window.location.href,
+        title: meta('citation_title') || document.title,
+        doi: meta('citation_doi')
+    };
+};
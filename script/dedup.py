@@ -0,0 +1,168 @@
+"""
+SYNOPSIS
+    dedup.py <reference-list>...
+
+DESCRIPTION
+    Group near-duplicate reference strings, e.g. the same cited
+    paper formatted differently by ACM, Springer and arXiv.
+
+    The title-like part of each reference is normalized and hashed
+    into a MinHash signature of character n-grams (one permutation
+    hashing, so one pass over the n-grams); references whose
+    signatures collide in a LSH band are compared with the first
+    member of that bucket only, which keeps clustering linear in
+    the number of references.
+
+    Writes one representative per cluster to stdout, and the number
+    of clusters to stderr.
+
+SEE ALSO
+    snowball.py(1)
+"""
+import re
+import sys
+import unicodedata
+import zlib
+from typing import Iterable
+
+_QUOTED = re.compile(r'[“"]([^”"]{16,})[”"]')
+_SEGMENT = re.compile(r'\.:?\s+')
+_DIGIT = re.compile(r'\d')
+# matched against lower-cased text: faster than re.IGNORECASE.
+_VENUE = re.compile(r'^\s*in\b|proceedings|conference|journal|symposium|workshop|'
+                    r'transactions|arxiv|preprint|\bvol\b|\bpp\b')
+
+
+def normalize(text: str) -> str:
+    """
+    Case-fold, drop accents and punctuation, collapse whitespace.
+    """
+    if not text.isascii():
+        text = unicodedata.normalize('NFKD', text)
+        text = ''.join(c for c in text if not unicodedata.combining(c))
+    text = re.sub(r'[^\w]+', ' ', text.casefold())
+    return ' '.join(text.split())
+
+
+def title_part(reference: str) -> str:
+    """
+    Guess the title of a reference string: a quoted part if any,
+    otherwise the longest wordy segment with few commas and digits
+    (author lists have many commas, venues many digits) that does
+    not look like a venue.
+    """
+    m = _QUOTED.search(reference)
+    if m is not None:
+        return m.group(1)
+    best = reference
+    best_score = None
+    for segment in _SEGMENT.split(reference):
+        words = len(segment.split())
+        if words < 3:
+            continue
+        score = words - 2 * segment.count(',') - len(_DIGIT.findall(segment))
+        if _VENUE.search(segment.lower()) is not None:
+            score -= words
+        if best_score is None or score > best_score:
+            best, best_score = segment, score
+    return best
+
+
+class Deduplicator():
+    def __init__(self, threshold: float = 0.7, ngram: int = 4,
+                 bins: int = 32, rows: int = 2):
+        """
+        :param: threshold: min estimated Jaccard similarity of the n-gram
+            sets for two references to be duplicates.
+        :param: bins: length of the MinHash signature.
+        :param: rows: rows per LSH band; bins must be a multiple of it.
+        """
+        assert bins % rows == 0
+        self.threshold = threshold
+        self.ngram = ngram
+        self.bins = bins
+        self.rows = rows
+        self.exact: dict[str, int] = dict()
+        self.buckets: list[dict[tuple, int]] = [dict() for _ in range(bins // rows)]
+        self.signatures: list[tuple] = []
+
+    def signature(self, text: str) -> tuple:
+        text = text.replace(' ', '')
+        n = self.ngram
+        bins = self.bins
+        sig = [None] * bins
+        for i in range(max(1, len(text) - n + 1)):
+            h = zlib.crc32(text[i:i + n].encode('utf-8'))
+            b = h % bins
+            v = h // bins
+            if sig[b] is None or v < sig[b]:
+                sig[b] = v
+        # densify: empty bins borrow the value of the next non-empty bin.
+        if any(v is None for v in sig) and any(v is not None for v in sig):
+            for b in range(bins):
+                if sig[b] is None:
+                    k = b
+                    while sig[k % bins] is None:
+                        k += 1
+                    sig[b] = sig[k % bins] + (k - b) * 0x9e3779b1
+        return tuple(sig)
+
+    def similarity(self, a: tuple, b: tuple) -> float:
+        return sum(x == y for x, y in zip(a, b)) / self.bins
+
+    def add(self, reference: str) -> int:
+        """
+        :return: index of the cluster (the index of its first member
+            among added references) reference belongs to.
+        """
+        idx = len(self.signatures)
+        key = normalize(title_part(reference))
+        if key in self.exact:
+            self.signatures.append(())
+            return self.exact[key]
+        sig = self.signature(key)
+        self.signatures.append(sig)
+        rep = idx
+        bands = [sig[i:i + self.rows] for i in range(0, self.bins, self.rows)]
+        for band, bucket in zip(bands, self.buckets):
+            other = bucket.get(band, None)
+            if other is not None and self.similarity(sig, self.signatures[other]) >= self.threshold:
+                rep = other
+                break
+        if rep == idx:
+            for band, bucket in zip(bands, self.buckets):
+                bucket.setdefault(band, idx)
+        self.exact[key] = rep
+        return rep
+
+
+def cluster(references: Iterable[str], **kwargs) -> dict[int, list[int]]:
+    """
+    :return: index of each representative mapped to the indices
+        of its cluster members (itself included), in input order.
+    """
+    dedup = Deduplicator(**kwargs)
+    clusters: dict[int, list[int]] = dict()
+    for idx, reference in enumerate(references):
+        rep = dedup.add(reference)
+        clusters.setdefault(rep, []).append(idx)
+    return clusters
+
+
+if __name__ == "__main__":
+    args = sys.argv
+    if len(args) < 2:
+        print("Usage: dedup.py <reference-list>...", file=sys.stderr)
+        sys.exit(1)
+
+    references: list[str] = []
+    for ifile in args[1:]:
+        with open(ifile, 'r', encoding='utf-8') as fobj:
+            for line in fobj:
+                if len(line.strip()) > 0:
+                    references.append(line.strip())
+
+    clusters = cluster(references)
+    for rep in clusters:
+        print(references[rep])
+    print(f"{len(references)} references, {len(clusters)} clusters", file=sys.stderr)
@@ -1,45 +1,172 @@
 import requests
-import subprocess
+from requests.adapters import HTTPAdapter
 import os
 import time
 import sys
+import json
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from seleniumbase import Driver
-import bibtexparser
+import bibload
+import metrics
+from bibstore import BibStore
+from throttle import DomainScheduler, domain_name
 
 # FIXME: not usage; Segmentation Fault
 # import magic
 
+# PDF readers accept the header anywhere in the first 1024 bytes.
+PDF_MAGIC = b'%PDF-'
+PDF_MAGIC_WINDOW = 1024
+CHUNK_SIZE = 1 << 16
+TIMEOUT = 60
+
+_session: requests.Session | None = None
+_session_lock = threading.Lock()
+
+
+def shared_session() -> requests.Session:
+    """
+    A keep-alive session shared by all downloads of the process.
+    """
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=16, pool_maxsize=16)
+            _session.mount('http://', adapter)
+            _session.mount('https://', adapter)
+        return _session
+
+
 def format_is_pdf(file: str) -> bool:
     if not os.path.exists(file):
         raise FileNotFoundError(f"File '{file}' does not exist.")
-    res = subprocess.run(['file', '--mime-type', file], capture_output=True, text=True)
-    if res.returncode != 0:
-        raise RuntimeError(f"Failed to run 'file' command: {res.stderr}")
-    ret ='application/pdf' in res.stdout.lower()
-    del res
-    return ret
+    with open(file, 'rb') as fobj:
+        return PDF_MAGIC in fobj.read(PDF_MAGIC_WINDOW)
 
 
-def download_others(url: str, ofile: str):
+def save_response(response: requests.Response, ofile: str) -> dict:
+    """
+    Stream the body of response to ofile. The body is written to
+    {ofile}.part and renamed into place once complete, so ofile
+    never holds a truncated download. A body that does not start
+    like a PDF is rejected after its first chunks. A 206 response
+    is appended to the bytes already in {ofile}.part.
+
+    :return: the final url, size, sha256 and validators of the file.
+    """
+    part = ofile + '.part'
+    sha = hashlib.sha256()
+    size = 0
+    head = b''
+    resumed = response.status_code == 206 and os.path.exists(part)
+    if resumed:
+        with open(part, 'rb') as fobj:
+            for chunk in iter(lambda: fobj.read(CHUNK_SIZE), b''):
+                if len(head) < PDF_MAGIC_WINDOW:
+                    head += chunk[:PDF_MAGIC_WINDOW - len(head)]
+                sha.update(chunk)
+                size += len(chunk)
+    try:
+        with open(part, 'ab' if resumed else 'wb') as fobj:
+            for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+                if len(head) < PDF_MAGIC_WINDOW:
+                    head += chunk[:PDF_MAGIC_WINDOW - len(head)]
+                    if len(head) >= PDF_MAGIC_WINDOW and PDF_MAGIC not in head:
+                        raise ValueError(f"Response from '{response.url}' is not a PDF.")
+                fobj.write(chunk)
+                sha.update(chunk)
+                size += len(chunk)
+        if PDF_MAGIC not in head:
+            raise ValueError(f"Response from '{response.url}' is not a PDF.")
+    except ValueError:
+        os.unlink(part)
+        raise
+    # other errors keep {ofile}.part, to be resumed by the next run.
+    os.replace(part, ofile)
+    return {
+        'final_url': response.url,
+        'size': size,
+        'sha256': sha.hexdigest(),
+        'etag': response.headers.get('ETag', None),
+        'last_modified': response.headers.get('Last-Modified', None),
+    }
+
+
+def fetch_pdf(url: str, ofile: str, session: requests.Session | None = None,
+              headers: dict | None = None, record: dict | None = None) -> dict | None:
+    """
+    GET url into ofile. A partial {ofile}.part left by an earlier
+    attempt is resumed with a Range request, guarded by If-Range so
+    that a changed file is fetched again from the start.
+
+    :param: record: manifest record of an existing ofile; its validators
+        make the request conditional.
+    :return: see save_response; None if record is still up to date.
+    """
+    session = shared_session() if session is None else session
+    headers = dict() if headers is None else dict(headers)
+    part = ofile + '.part'
+    meta = part + '.json'
+    if record is not None and os.path.exists(ofile):
+        if record.get('etag', None):
+            headers['If-None-Match'] = record['etag']
+        if record.get('last_modified', None):
+            headers['If-Modified-Since'] = record['last_modified']
+    elif os.path.exists(part) and os.path.exists(meta):
+        with open(meta, 'r', encoding='utf-8') as fobj:
+            validators = json.load(fobj)
+        validator = validators.get('etag', None) or validators.get('last_modified', None)
+        if validator and validators.get('url', None) == url:
+            headers['Range'] = f"bytes={os.path.getsize(part)}-"
+            headers['If-Range'] = validator
+
+    with session.get(url, headers=headers, stream=True, timeout=TIMEOUT) as res:
+        if res.status_code == 304:
+            return None
+        if res.status_code == 416 and 'Range' in headers:
+            # the partial file is stale, start over.
+            os.unlink(part)
+            del headers['Range'], headers['If-Range']
+            return fetch_pdf(url, ofile, session, headers)
+        if res.status_code not in (200, 206):
+            raise ValueError(f"Failed to download paper from {url}. HTTP status code: {res.status_code}")
+        if res.status_code == 200:
+            with open(meta, 'w', encoding='utf-8') as fobj:
+                json.dump({'url': url,
+                           'etag': res.headers.get('ETag', None),
+                           'last_modified': res.headers.get('Last-Modified', None)}, fobj)
+        try:
+            info = save_response(res, ofile)
+        except ValueError:
+            # save_response removed {ofile}.part, its validators go too.
+            if os.path.exists(meta):
+                os.unlink(meta)
+            raise
+    if os.path.exists(meta):
+        os.unlink(meta)
+    info['url'] = url
+    return info
+
+
+def download_others(url: str, ofile: str) -> dict:
     """
     Assume url points to a pdf file, and can access being blocked.
     """
-    res = requests.get(url)
-    with open(ofile, 'wb') as fobj:
-        fobj.write(res.content)
-    if not format_is_pdf(ofile):
-        raise ValueError(f"Downloaded file '{ofile}' is not a PDF.")
+    return fetch_pdf(url, ofile)
 
 
-def download_arxiv(url: str, ofile: str):
+def download_arxiv(url: str, ofile: str) -> dict:
     """
     Download a paper from arXiv given its URL and save it to the specified output file.
     """
     url = url.replace('abs', 'pdf')
-    download_others(url, ofile)
+    return download_others(url, ofile)
 
 
-def download_acm_dl(url: str, ofile: str):
+def download_acm_dl(url: str, ofile: str) -> dict:
     """
     Download a paper from ACM Digital Library given its URL and save it to the specified output file.
     """
@@ -54,42 +181,30 @@ def download_acm_dl(url: str, ofile: str):
         "User-Agent": driver.execute_script("return navigator.userAgent;")
     }
 
-    response = session.get(url, headers=headers)
-    status_code = response.status_code
-
-    if status_code != 200:
+    try:
+        info = fetch_pdf(url, ofile, session, headers)
+    finally:
         driver.quit()
-        raise ValueError(f"Failed to download paper from {url}. HTTP status code: {status_code}")
-
-    with open(ofile, "wb") as f:
-        f.write(response.content)
+    return info
 
-    driver.quit()
-    if not format_is_pdf(ofile):
-        raise ValueError(f"Downloaded file '{ofile}' is not a PDF.")
 
-
-def download_doi_org(url: str, ofile: str):
+def download_doi_org(url: str, ofile: str) -> dict:
     """
     Download a paper from DOI.org given its URL and save it to the specified output file.
     """
-    success = False
     try:
-        download_others(url, ofile)
-        success = True
+        return download_others(url, ofile)
     except Exception as e:
-        success = False
+        pass
     # translate the url:
     # https://doi.org/10.1145/3395363.3397369
     # -> https://dl.acm.org/doi/pdf/10.1145/3395363.3397369
-    if success:
-        return
     toks = url.split('/')
     if len(toks) < 2:
         raise ValueError(f"Invalid DOI URL: {url}")
     doi = toks[-2] + '/' + toks[-1]
     acm_url = f"https://dl.acm.org/doi/pdf/{doi}"
-    download_acm_dl(acm_url, ofile)
+    return download_acm_dl(acm_url, ofile)
 
 
 DEFAULT_DOWNLOADER = {
@@ -99,38 +214,173 @@ DEFAULT_DOWNLOADER = {
 }
 
 
-def domain_name(url: str) -> str:
-    try:
-        idx = url.index('://')
-        url = url[idx+3:]
-    except ValueError:
-        pass
-    try:
-        idx = url.index('/')
-        url = url[:idx]
-    except ValueError:
-        pass
-    return url
-
-
-def download_paper(url: str, ofile: str):
+def download_paper(url: str, ofile: str) -> dict | None:
+    """
+    :return: the manifest record of ofile, None on failure.
+    """
     domain = domain_name(url)
     downloader = DEFAULT_DOWNLOADER.get(domain, download_others)
 
-    try:
-        downloader(url, ofile)
-    except Exception as e:
-        print(f"Error downloading paper from {url}: {e}", file=sys.stderr)
-        # manually download the paper.
-        if os.path.exists(ofile):
-            os.unlink(ofile)
+    with metrics.timer('download', domain) as event:
+        try:
+            info = downloader(url, ofile)
+        except Exception as e:
+            # manually download the paper; partial downloads never
+            # reach ofile, so there is nothing to clean up.
+            print(f"Error downloading paper from {url}: {e}", file=sys.stderr)
+            event['ok'] = False
+            return None
+        if info is None:
+            info = {'size': os.path.getsize(ofile), 'sha256': file_sha256(ofile)}
+        event['bytes'] = info['size']
+    info['url'] = url
+    info['status'] = 'ok'
+    return info
+
+
+def refresh_paper(record: dict, ofile: str) -> dict | None:
+    """
+    Re-fetch ofile with a conditional request, if it changed since record.
+
+    :return: the new record, None on failure.
+    """
+    url = record.get('final_url', None) or record['url']
+    with metrics.timer('download.refresh', domain_name(url)) as event:
+        try:
+            info = fetch_pdf(url, ofile, record=record)
+        except Exception as e:
+            print(f"Error refreshing paper from {url}: {e}", file=sys.stderr)
+            event['ok'] = False
+            return None
+        if info is None:
+            return record
+        event['bytes'] = info['size']
+    info['url'] = record['url']
+    info['status'] = 'ok'
+    return info
+
+
+def file_sha256(file: str) -> str:
+    sha = hashlib.sha256()
+    with open(file, 'rb') as fobj:
+        for chunk in iter(lambda: fobj.read(CHUNK_SIZE), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+class Manifest():
+    """
+    {save dir}/manifest.json: for each entry ID, the url, final url,
+    size, sha256, ETag/Last-Modified and status of its pdf.
+
+    Updates are appended to manifest.jsonl, one [ID, record] line
+    each, and folded into manifest.json by close(), or when the next
+    run finds the log of an interrupted one.
+    """
+    def __init__(self, savedir: str | None):
+        self.path = os.path.join(savedir, 'manifest.json') if savedir else 'manifest.json'
+        self.log_path = self.path + 'l'
+        self.records: dict[str, dict] = dict()
+        if os.path.exists(self.path):
+            with open(self.path, 'r', encoding='utf-8') as fobj:
+                self.records = json.load(fobj)
+        if os.path.exists(self.log_path):
+            with open(self.log_path, 'r', encoding='utf-8') as fobj:
+                for line in fobj:
+                    try:
+                        key, record = json.loads(line)
+                    except ValueError:
+                        # torn last line of an interrupted run.
+                        break
+                    self.records[key] = record
+            self._compact()
+        self.log = None
+        self.lock = threading.Lock()
+
+    def get(self, key: str) -> dict | None:
+        with self.lock:
+            return self.records.get(key, None)
+
+    def update(self, key: str, record: dict) -> None:
+        with self.lock:
+            self.records[key] = record
+            if self.log is None:
+                self.log = open(self.log_path, 'a', encoding='utf-8')
+            self.log.write(json.dumps([key, record]) + '\n')
+            self.log.flush()
+
+    def failed(self, key: str, url: str) -> None:
+        """
+        Record a failed download of key. A complete pdf keeps its
+        record (size, sha256...), only the time of the failure is added.
+        """
+        now = time.strftime('%Y-%m-%dT%H:%M:%S')
+        record = self.get(key)
+        if record is not None and record['status'] == 'ok':
+            self.update(key, {**record, 'failed_at': now})
+        else:
+            self.update(key, {'url': url, 'status': 'failed', 'failed_at': now})
+
+    def _compact(self) -> None:
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as fobj:
+            json.dump(self.records, fobj, indent=1, sort_keys=True)
+        os.replace(tmp, self.path)
+        if os.path.exists(self.log_path):
+            os.unlink(self.log_path)
+
+    def close(self) -> None:
+        with self.lock:
+            if self.log is None:
+                return
+            self.log.close()
+            self.log = None
+            self._compact()
 
 
-def download_from_bib(bibfile: str, savedir: str | None) -> str:
+def _collected_pdf(store: BibStore, manifest: Manifest, entry: dict,
+                   savedir: str | None) -> str | None:
+    """
+    :return: the complete pdf of an entry of store with the same DOI
+        or eprint as entry, None if there is none.
+    """
+    same = []
+    if 'doi' in entry:
+        same += store.by_doi(entry['doi'])
+    if 'eprint' in entry:
+        same += store.by_eprint(entry['eprint'])
+    for other in same:
+        key = other.get('ID', '')
+        record = manifest.get(key)
+        ofile = os.path.join(savedir, f"{key}.pdf") if savedir else f"{key}.pdf"
+        if record is not None and record['status'] == 'ok' and os.path.exists(ofile) \
+                and record['size'] == os.path.getsize(ofile):
+            return ofile
+    return None
+
+
+def download_from_bib(bibfile: str, savedir: str | None, jobs: int = 1, **kwargs):
     """
     Parse the bib file, and download the pdf file to {savedir}/{id}.pdf
+
+    An entry is skipped if its pdf is recorded as complete in the
+    manifest and has the recorded size, or if the bib store has an
+    entry with the same DOI or eprint whose pdf is complete under
+    its own ID (e.g. an article of ../dataset found again by
+    snowballing).
+
+    :param: jobs: number of downloads running at the same time.
+    :param: store: a BibStore of the collected articles, optional.
+    :param: per_domain: max concurrent downloads from one domain (default 1).
+    :param: delay: min seconds between downloads from one domain (default 10).
+    :param: refresh: re-check complete pdfs with conditional requests.
     """
-    lib = bibtexparser.load(open(bibfile, encoding='utf-8'))
+    scheduler = DomainScheduler(kwargs.get('per_domain', 1), kwargs.get('delay', 10.0))
+    refresh: bool = kwargs.get('refresh', False)
+    store: BibStore | None = kwargs.get('store', None)
+    manifest = Manifest(savedir)
+    lib = bibload.load(bibfile)
+    total = 0
     for entry in lib.entries:
         if 'url' not in entry:
             print(f"Entry '{entry.get('ID', 'unknown')}' does not have a URL. Skipping.", file=sys.stderr)
@@ -138,17 +388,134 @@ def download_from_bib(bibfile: str, savedir: str | None) -> str:
         if 'ID' not in entry:
             print(f"Entry with URL '{entry['url']}' does not have an ID. Using 'unknown' as filename.", file=sys.stderr)
         url = entry['url']
-        obasename = f"{entry.get('ID', 'unknown')}.pdf"
-        ofile = os.path.join(savedir, obasename) if savedir else obasename
+        key = entry.get('ID', 'unknown')
+        ofile = os.path.join(savedir, f"{key}.pdf") if savedir else f"{key}.pdf"
+        record = manifest.get(key)
+        if store is not None and record is None and not os.path.exists(ofile):
+            other = _collected_pdf(store, manifest, entry, savedir)
+            if other is not None:
+                print(f"Entry '{key}' is already downloaded as '{other}'. Skipping.", file=sys.stderr)
+                continue
+        if os.path.exists(ofile):
+            if record is None and format_is_pdf(ofile):
+                # downloaded before the manifest existed.
+                record = {'url': url, 'size': os.path.getsize(ofile),
+                          'sha256': file_sha256(ofile), 'status': 'ok'}
+                manifest.update(key, record)
+            if record is not None and record['status'] == 'ok' \
+                    and record['size'] == os.path.getsize(ofile):
+                if not refresh:
+                    continue
+            else:
+                record = None
+        else:
+            record = None
+        scheduler.put(domain_name(url), (key, url, ofile, record))
+        total += 1
+
+    lock = threading.Lock()
+    stats = {'done': 0, 'failed': 0, 'bytes': 0}
+    start_time = time.time()
+
+    def _worker():
+        while True:
+            job = scheduler.get()
+            if job is None:
+                return
+            domain, (key, url, ofile, record) = job
+            try:
+                if record is not None:
+                    info = refresh_paper(record, ofile)
+                else:
+                    info = download_paper(url, ofile)
+            finally:
+                scheduler.done(domain)
+            if info is None:
+                manifest.failed(key, url)
+            elif info is not record:
+                manifest.update(key, info)
+            with lock:
+                stats['done'] += 1
+                if info is not None:
+                    stats['bytes'] += info['size'] if info is not record else 0
+                else:
+                    stats['failed'] += 1
+                elapsed = time.time() - start_time
+                print(f"[{stats['done']}/{total}] {domain}: {'ok' if info is not None else 'failed'}, "
+                      f"{stats['done'] / elapsed:.2f} papers/s", file=sys.stderr)
+
+    workers = [threading.Thread(target=_worker) for _ in range(max(1, jobs))]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    manifest.close()
+
+    elapsed = time.time() - start_time
+    print(f"Downloaded {stats['done'] - stats['failed']}/{total} papers "
+          f"({stats['failed']} failed, {stats['bytes'] / 2**20:.1f} MiB) in {elapsed:.1f} s, "
+          f"{stats['bytes'] / 2**20 / max(elapsed, 1e-9):.2f} MiB/s", file=sys.stderr)
+
+
+def verify_library(savedir: str | None, jobs: int = 4) -> int:
+    """
+    Re-hash every pdf recorded in the manifest, in parallel. Pdfs that are
+    missing or do not match are marked, so that the next run downloads
+    them again.
+
+    :return: the number of bad pdfs.
+    """
+    manifest = Manifest(savedir)
+    keys = [k for k, r in manifest.records.items() if r['status'] == 'ok']
+
+    def _check(key: str) -> str:
+        record = manifest.get(key)
+        ofile = os.path.join(savedir, f"{key}.pdf") if savedir else f"{key}.pdf"
         if not os.path.exists(ofile):
-            download_paper(url, ofile)
-            time.sleep(10)  # avoid being blocked by the server
+            return 'missing'
+        if os.path.getsize(ofile) != record['size'] or file_sha256(ofile) != record['sha256']:
+            return 'corrupt'
+        return 'ok'
+
+    bad = 0
+    # hashlib releases the GIL on large buffers, threads are enough.
+    with ThreadPoolExecutor(max_workers=max(1, jobs)) as executor:
+        for key, status in zip(keys, executor.map(_check, keys)):
+            if status == 'ok':
+                continue
+            print(f"{key}: {status}", file=sys.stderr)
+            record = dict(manifest.get(key))
+            record['status'] = status
+            manifest.update(key, record)
+            bad += 1
+    manifest.close()
+    print(f"Verified {len(keys)} papers, {bad} bad.", file=sys.stderr)
+    return bad
 
 
 if __name__ == "__main__":
     args = sys.argv
-    if len(args) != 3:
-        print("Usage: download.py <bibsource> <save dir>")
+    if len(args) in (3, 4) and args[1] == '--verify':
+        bad = verify_library(args[2], int(args[3]) if len(args) == 4 else 4)
+        sys.exit(1 if bad > 0 else 0)
+    refresh = len(args) > 1 and args[1] == '--refresh'
+    if refresh:
+        args = args[1:]
+    if len(args) not in (3, 4):
+        print("Usage: download.py [--refresh] <bibsource> <save dir> [jobs]")
+        print("       download.py --verify <save dir> [jobs]")
         sys.exit(1)
 
-    download_from_bib(args[1], args[2])
+    # BIBSTORE: as in bibstore.py, empty to download entries already collected
+    store = None
+    if os.environ.get('BIBSTORE', None) != '':
+        store = BibStore()
+        store.sync()
+    # PER_DOMAIN / DELAY: politeness towards each host (default: 1 download, 10 s apart)
+    download_from_bib(args[1], args[2], int(args[3]) if len(args) == 4 else 1,
+                      refresh = refresh,
+                      store = store,
+                      per_domain = int(os.environ.get('PER_DOMAIN', '1')),
+                      delay = float(os.environ.get('DELAY', '10')))
+    if store is not None:
+        store.close()
@@ -0,0 +1,105 @@
+"""
+DESCRIPTION
+    On-disk (SQLite) cache of chat model answers used by snowball.py.
+
+    Answers are keyed on the normalized reference text together with
+    the model name, the temperature and a fingerprint of the prompt
+    template, so changing any of them never serves a stale answer.
+
+SEE ALSO
+    snowball.py(1)
+"""
+import hashlib
+import sqlite3
+import threading
+import time
+
+
+def normalize_reference(item: str) -> str:
+    """
+    Case-fold and collapse whitespace so that the same reference
+    extracted by different scrapers shares one cache entry.
+    """
+    return ' '.join(item.split()).casefold()
+
+
+class ResponseCache():
+    def __init__(self, path: str, max_entries: int = 100000,
+                 max_age: float = 30 * 24 * 3600):
+        """
+        :param: path: the sqlite database file.
+        :param: max_entries: keep at most that many answers (0 for no limit).
+        :param: max_age: drop answers older than that many seconds (0 for no limit).
+        """
+        self.max_entries = max_entries
+        self.max_age = max_age
+        self.hits = 0
+        self.misses = 0
+        # shared by the worker threads of pipeline.py, under self.lock.
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.lock = threading.Lock()
+        self.db.execute("""
+            CREATE TABLE IF NOT EXISTS cache (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                created REAL NOT NULL,
+                accessed REAL NOT NULL
+            )""")
+        self.db.execute("CREATE INDEX IF NOT EXISTS cache_accessed ON cache(accessed)")
+        self.db.commit()
+        self.evict()
+
+    @staticmethod
+    def make_key(item: str, model: str, temperature: float, template: str) -> str:
+        """
+        :param: template: fingerprint of the prompt template.
+        """
+        h = hashlib.sha256()
+        for part in (model, repr(temperature), template, normalize_reference(item)):
+            h.update(part.encode('utf-8'))
+            h.update(b'\0')
+        return h.hexdigest()
+
+    def get(self, key: str) -> str | None:
+        with self.lock:
+            row = self.db.execute("SELECT value, created FROM cache WHERE key = ?",
+                                  (key,)).fetchone()
+            now = time.time()
+            if row is None or (self.max_age > 0 and row[1] < now - self.max_age):
+                self.misses += 1
+                return None
+            self.db.execute("UPDATE cache SET accessed = ? WHERE key = ?", (now, key))
+            self.hits += 1
+            return row[0]
+
+    def put(self, key: str, value: str) -> None:
+        now = time.time()
+        with self.lock:
+            self.db.execute("INSERT OR REPLACE INTO cache VALUES (?, ?, ?, ?)",
+                            (key, value, now, now))
+            self.db.commit()
+
+    def evict(self) -> None:
+        """
+        Remove expired answers, then the least recently used ones
+        above max_entries.
+        """
+        with self.lock:
+            if self.max_age > 0:
+                self.db.execute("DELETE FROM cache WHERE created < ?",
+                                (time.time() - self.max_age,))
+            if self.max_entries > 0:
+                self.db.execute("""
+                    DELETE FROM cache WHERE key IN (
+                        SELECT key FROM cache ORDER BY accessed DESC LIMIT -1 OFFSET ?
+                    )""", (self.max_entries,))
+            self.db.commit()
+
+    def stats(self) -> str:
+        total = self.hits + self.misses
+        rate = self.hits / total * 100 if total > 0 else 0.0
+        return f"Cache: {self.hits} hits, {self.misses} misses ({rate:.1f}% hit rate)"
+
+    def close(self) -> None:
+        self.evict()
+        self.db.close()
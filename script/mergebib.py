@@ -0,0 +1,149 @@
+"""
+SYNOPSIS
+    mergebib.py <output.bib> <bibfile>...
+
+DESCRIPTION
+    Merge bib files into output.bib (main.bib in the Makefile).
+
+    Entries sharing their ID are kept once (the first one met); a
+    warning is printed if they disagree on title, DOI or year. Entries
+    with different IDs but the same DOI or normalized title are all
+    kept, since each ID may be cited, and a warning names them so that
+    the citations can be unified. Entries are written sorted by ID, so
+    the output only depends on the entries, not on the order of the
+    files.
+
+    output.bib is left untouched (same content, same mtime) if the
+    merged content has the same hash, so that make does not rebuild
+    the document for nothing.
+
+SEE ALSO
+    bibstore.py(1)
+"""
+import hashlib
+import os
+import sys
+import bibtexparser
+from bibtexparser.bibdatabase import BibDatabase
+from bibtexparser.bparser import BibTexParser
+from bibtexparser.bwriter import BibTexWriter
+
+import bibload
+from bibstore import normalize_doi
+from titleindex import normalize_title
+
+COMPARED_FIELDS = ('title', 'doi', 'year')
+
+
+def _keys(entry: dict) -> list[str]:
+    """
+    :return: the DOI and title keys of entry, to find its duplicates
+        under another ID.
+    """
+    keys = []
+    if 'doi' in entry:
+        keys.append('doi:' + normalize_doi(entry['doi']))
+    if 'title' in entry:
+        title = normalize_title(entry['title'])
+        if title != '':
+            keys.append('title:' + title)
+    return keys
+
+
+def _field(entry: dict, field: str) -> str | None:
+    if field not in entry:
+        return None
+    if field == 'title':
+        return normalize_title(entry[field])
+    if field == 'doi':
+        return normalize_doi(entry[field])
+    return entry[field].strip()
+
+
+def _conflicts(kept: dict, other: dict) -> list[str]:
+    """
+    :return: fields both entries have, with different values.
+    """
+    ret = []
+    for field in COMPARED_FIELDS:
+        a, b = _field(kept, field), _field(other, field)
+        if a is not None and b is not None and a != b:
+            ret.append(field)
+    return ret
+
+
+def _load(path: str) -> list[dict]:
+    # unlike bibload, keep @software and other non-standard entries:
+    # they are cited too.
+    parser = BibTexParser(common_strings=True, ignore_nonstandard_types=False)
+    with open(path, 'r', encoding='utf-8') as fobj:
+        return bibtexparser.load(fobj, parser=parser).entries
+
+
+def merge(bibfiles: list[str]) -> list[dict]:
+    """
+    :return: entries with distinct IDs, sorted by ID.
+    """
+    entries: list[dict] = []
+    origin: list[str] = []
+    by_id: dict[str, int] = dict()
+    by_key: dict[str, int] = dict()
+    for path in bibfiles:
+        for entry in _load(path):
+            idx = by_id.get(entry['ID'], None)
+            if idx is not None:
+                kept = entries[idx]
+                conflicts = _conflicts(kept, entry)
+                if len(conflicts) > 0:
+                    print(f"warning: {entry['ID']} differs between {origin[idx]} and {path} "
+                          f"in {', '.join(conflicts)}; keeping the one of {origin[idx]}",
+                          file=sys.stderr)
+                continue
+            for key in _keys(entry):
+                if key not in by_key:
+                    by_key[key] = len(entries)
+                    continue
+                other = entries[by_key[key]]
+                print(f"warning: {entry['ID']} ({path}) and {other['ID']} "
+                      f"({origin[by_key[key]]}) share {key.split(':')[0]}; keeping both",
+                      file=sys.stderr)
+                break
+            by_id[entry['ID']] = len(entries)
+            entries.append(entry)
+            origin.append(path)
+    return sorted(entries, key=lambda e: (e['ID'].casefold(), e['ID']))
+
+
+def dumps(entries: list[dict]) -> str:
+    lib = BibDatabase()
+    lib.entries = entries
+    writer = BibTexWriter()
+    writer.order_entries_by = None
+    return writer.write(lib)
+
+
+def write_if_changed(ofile: str, content: str) -> bool:
+    """
+    :return: whether ofile was (re)written.
+    """
+    data = content.encode('utf-8')
+    if os.path.exists(ofile) and bibload._sha256(ofile) == hashlib.sha256(data).hexdigest():
+        return False
+    tmp = ofile + '.tmp'
+    with open(tmp, 'wb') as fobj:
+        fobj.write(data)
+    os.replace(tmp, ofile)
+    return True
+
+
+if __name__ == "__main__":
+    args = sys.argv
+    if len(args) < 3:
+        print("Usage: mergebib.py <output.bib> <bibfile>...", file=sys.stderr)
+        sys.exit(1)
+
+    entries = merge(args[2:])
+    if write_if_changed(args[1], dumps(entries)):
+        print(f"Remake {args[1]}: {len(entries)} entries", file=sys.stderr)
+    else:
+        print(f"{args[1]} is up to date", file=sys.stderr)
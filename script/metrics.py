@@ -0,0 +1,180 @@
+"""
+SYNOPSIS
+    metrics.py <events.jsonl>
+
+DESCRIPTION
+    Timers and counters shared by the scripts. When METRICS is set,
+    each timed step appends one JSON line to that file:
+
+        {"stage": ..., "domain": ..., "start": <unix time>,
+         "secs": <duration>, "ok": <bool>, ...extra fields}
+
+    Stages: browser.launch, page.load, execute_script, llm (with
+    prompt/response tokens), http.fetch and download (with bytes).
+
+    When run, it reports per stage and domain the number of events,
+    failure rate, throughput and p50/p95/p99 durations, plus the sum
+    of the bytes and tokens fields.
+
+ENVIRONMENT
+    METRICS: events file (default: none, nothing is written)
+    PROFILE: write the cProfile stats of the whole run (all threads)
+        to that file, for `python -m pstats` or snakeviz (default: none).
+        For a sampling profile, run the script under
+        `py-spy record --threads -o run.svg -- python <script>` instead.
+"""
+import atexit
+import cProfile
+import json
+import os
+import pstats
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+
+METRICS = os.environ.get('METRICS', '')
+
+_lock = threading.Lock()
+_events = None
+
+
+def emit(event: dict) -> None:
+    """
+    Append event to the METRICS file, if any.
+    """
+    global _events
+    if METRICS == '':
+        return
+    line = json.dumps(event) + '\n'
+    with _lock:
+        if _events is None:
+            _events = open(METRICS, 'a', encoding='utf-8')
+            atexit.register(_events.close)
+        _events.write(line)
+        _events.flush()
+
+
+@contextmanager
+def timer(stage: str, domain: str = '', **fields):
+    """
+    with timer('download', domain) as event:
+        ...
+        event['bytes'] = size
+
+    Records the duration of the block, and whether it raised.
+    """
+    event = {'stage': stage, 'domain': domain, 'start': time.time(), **fields}
+    clock = time.perf_counter()
+    ok = False
+    try:
+        yield event
+        ok = True
+    finally:
+        event['secs'] = time.perf_counter() - clock
+        event['ok'] = ok and event.get('ok', True)
+        emit(event)
+
+
+def domain(url: str) -> str:
+    return urlsplit(url).netloc
+
+
+def count(stage: str, domain: str = '', ok: bool = True, **fields) -> None:
+    """
+    Record an event without duration.
+    """
+    emit({'stage': stage, 'domain': domain, 'start': time.time(), 'ok': ok, **fields})
+
+
+def percentile(values: list[float], q: float) -> float:
+    """
+    Nearest-rank percentile, q in [0, 100].
+    """
+    values = sorted(values)
+    if len(values) == 0:
+        return 0.0
+    rank = max(1, -(-len(values) * q // 100))
+    return values[int(rank) - 1]
+
+
+def report(path: str) -> str:
+    groups: dict[tuple[str, str], list[dict]] = dict()
+    with open(path, 'r', encoding='utf-8') as fobj:
+        for line in fobj:
+            if len(line.strip()) == 0:
+                continue
+            event = json.loads(line)
+            groups.setdefault((event['stage'], event.get('domain', '')), []).append(event)
+
+    lines = [f"{'stage':<16} {'domain':<24} {'n':>6} {'failed':>7} {'per s':>7} "
+             f"{'p50':>8} {'p95':>8} {'p99':>8}  totals"]
+    for (stage, domain), events in sorted(groups.items()):
+        secs = [e['secs'] for e in events if 'secs' in e]
+        failed = sum(1 for e in events if not e.get('ok', True))
+        begin = min(e['start'] for e in events)
+        end = max(e['start'] + e.get('secs', 0.0) for e in events)
+        throughput = len(events) / (end - begin) if end > begin else 0.0
+        totals = []
+        for field in ('bytes', 'prompt_tokens', 'response_tokens'):
+            total = sum(e.get(field, 0) or 0 for e in events)
+            if total > 0:
+                totals.append(f"{field}={total}")
+        lines.append(f"{stage:<16} {domain[:24]:<24} {len(events):>6} "
+                     f"{failed / len(events) * 100:>6.1f}% {throughput:>7.2f} "
+                     f"{percentile(secs, 50):>7.2f}s {percentile(secs, 95):>7.2f}s "
+                     f"{percentile(secs, 99):>7.2f}s  {' '.join(totals)}")
+    return '\n'.join(lines)
+
+
+_profiles: list[cProfile.Profile] = []
+
+
+def _profile_thread(*args) -> None:
+    # first profiler call in a new thread: hand over to cProfile.
+    prof = cProfile.Profile()
+    try:
+        prof.enable()
+    except ValueError:
+        # another profiler is active in this thread.
+        return
+    with _lock:
+        _profiles.append(prof)
+
+
+def _dump_profile(path: str) -> None:
+    threading.setprofile(None)
+    stats = None
+    for prof in _profiles:
+        prof.disable()
+        try:
+            if stats is None:
+                stats = pstats.Stats(prof)
+            else:
+                stats.add(prof)
+        except TypeError:
+            # nothing was collected.
+            continue
+    if stats is None:
+        print("Profile is empty, not written", file=sys.stderr)
+        return
+    stats.dump_stats(path)
+    print(f"Profile written to {path}", file=sys.stderr)
+
+
+if os.environ.get('PROFILE', '') != '':
+    _profile_thread()
+    # from 3.12, cProfile is process-wide (sys.monitoring): the profiler
+    # of the main thread sees every thread, and a second one cannot start.
+    if sys.version_info < (3, 12):
+        threading.setprofile(_profile_thread)
+    atexit.register(_dump_profile, os.environ['PROFILE'])
+
+
+if __name__ == "__main__":
+    args = sys.argv
+    if len(args) != 2:
+        print("Usage: metrics.py <events.jsonl>", file=sys.stderr)
+        sys.exit(1)
+    print(report(args[1]))
@@ -0,0 +1,265 @@
+"""
+SYNOPSIS
+    pdfrefs.py <save dir> [bibsource]
+
+DESCRIPTION
+    Export the reference lists of the pdfs downloaded by download.py
+    (save dir/<ID>.pdf) to pdfrefs.txt, one reference per line, as
+    snowball.py reads them. No browser is involved.
+
+    The text of each pdf is extracted with pypdf, from the last page
+    backwards until the references heading, or with pdftotext(1) if
+    pypdf is missing or fails. The references section is then split
+    at its [n] or n. markers, or at the line breaks following a
+    full stop for author-year styles.
+
+    Pdfs are processed in a pool of PROCESSES processes. The
+    references of each pdf are cached in .pdfcache/ (next to this
+    file) under its sha256, so unchanged pdfs are not parsed again.
+
+    If bibsource is given, pdfrefs.jsonl links each entry to its
+    references, for citegraph.py ingest.
+
+ENVIRONMENT
+    PROCESSES: number of processes extracting pdfs (default: 8)
+
+SEE ALSO
+    download.py(1)
+    snowball.py(1)
+    citegraph.py(1)
+"""
+import glob
+import hashlib
+import json
+import os
+import re
+import shutil
+import subprocess
+import sys
+import bibload
+from multiprocessing import Pool
+from citegraph import page_record
+
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.pdfcache')
+# bump when the extraction changes, to invalidate the cache.
+VERSION = 1
+PDFTOTEXT_TIMEOUT = 120
+
+_HEADING = re.compile(r'^[ \t]*(?:\d+\.?|[IVX]+\.)?[ \t]*(?:references|bibliography|'
+                      r'works cited|literature cited|r[ \t]?e[ \t]?f[ \t]?e[ \t]?r[ \t]?e[ \t]?n[ \t]?c[ \t]?e[ \t]?s)'
+                      r'[ \t]*:?[ \t]*$', re.IGNORECASE | re.MULTILINE)
+_END = re.compile(r'^[ \t]*(?:[A-Z]\.?[ \t]+)?(?:appendix|appendices|supplementary material)\b.*$',
+                  re.IGNORECASE | re.MULTILINE)
+_BRACKET = re.compile(r'^[ \t]*\[(\d{1,4})\][ \t]*', re.MULTILINE)
+_NUMBERED = re.compile(r'^[ \t]*(\d{1,4})\.[ \t]+(?=\S)', re.MULTILINE)
+_PAGE_NUMBER = re.compile(r'^[ \t]*\d{1,4}[ \t]*$', re.MULTILINE)
+_HYPHEN = re.compile(r'(\w)-\n(?=[a-z])')
+_SPACE = re.compile(r'\s+')
+# "Surname, A." / "A. Surname" / "Surname A" at the start of a line.
+_AUTHOR = re.compile(r"^(?:[A-Z][\w'\-]+,? (?:[A-Z]\.|[A-Z][\w'\-]+)|[A-Z]\. ?[A-Z])")
+
+MIN_LENGTH = 20
+MAX_LENGTH = 1000
+
+
+def _sha256(path: str) -> str:
+    sha = hashlib.sha256()
+    with open(path, 'rb') as fobj:
+        for chunk in iter(lambda: fobj.read(1 << 16), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def _pypdf_text(path: str) -> str | None:
+    """
+    Text of the pages of path from the one with the references
+    heading to the end, or of all pages if there is no heading.
+    """
+    try:
+        from pypdf import PdfReader
+    except ImportError:
+        return None
+    pages: list[str] = []
+    for page in reversed(PdfReader(path).pages):
+        pages.append(page.extract_text() or '')
+        if _HEADING.search(pages[-1]) is not None:
+            break
+    return '\n'.join(reversed(pages))
+
+
+def _pdftotext(path: str) -> str | None:
+    if shutil.which('pdftotext') is None:
+        return None
+    proc = subprocess.run(['pdftotext', '-enc', 'UTF-8', path, '-'],
+                          capture_output=True, timeout=PDFTOTEXT_TIMEOUT)
+    if proc.returncode != 0:
+        raise RuntimeError(f"pdftotext: {proc.stderr.decode('utf-8', errors='replace').strip()}")
+    return proc.stdout.decode('utf-8', errors='replace')
+
+
+def pdf_text(path: str) -> str:
+    """
+    :raise: RuntimeError if neither pypdf nor pdftotext could read path.
+    """
+    try:
+        text = _pypdf_text(path)
+        if text is not None and text.strip() != '':
+            return text
+        error = 'pypdf is not installed' if text is None else 'pypdf: no text'
+    except Exception as e:
+        error = f"pypdf: {e}"
+    text = _pdftotext(path)
+    if text is None:
+        raise RuntimeError(f"{error}, and pdftotext is not installed")
+    return text
+
+
+def references_section(text: str) -> str | None:
+    """
+    :return: the text after the last references heading, up to an
+        appendix, None without heading.
+    """
+    headings = list(_HEADING.finditer(text))
+    if len(headings) == 0:
+        return None
+    section = text[headings[-1].end():]
+    end = _END.search(section)
+    if end is not None:
+        section = section[:end.start()]
+    return section
+
+
+def _split_markers(section: str, marker: re.Pattern) -> list[str] | None:
+    """
+    Split section at the markers numbered 1, 2, 3... in order, so that
+    numbers inside a reference (pages, volumes) are not taken for one.
+    """
+    starts: list[tuple[int, int]] = []
+    expected = 1
+    for m in marker.finditer(section):
+        if int(m.group(1)) == expected:
+            starts.append((m.start(), m.end()))
+            expected += 1
+    if len(starts) < 2:
+        return None
+    ends = [start for start, _ in starts[1:]] + [len(section)]
+    return [section[body:end] for (_, body), end in zip(starts, ends)]
+
+
+def _split_author_year(section: str) -> list[str]:
+    references: list[str] = []
+    current: list[str] = []
+    for line in section.split('\n'):
+        line = line.strip()
+        if line == '':
+            continue
+        if current and current[-1].endswith('.') and _AUTHOR.match(line) is not None:
+            references.append(' '.join(current))
+            current = []
+        current.append(line)
+    if current:
+        references.append(' '.join(current))
+    return references
+
+
+def split_references(section: str) -> list[str]:
+    section = _PAGE_NUMBER.sub('', section)
+    section = _HYPHEN.sub(r'\1', section)
+    references = _split_markers(section, _BRACKET)
+    if references is None:
+        references = _split_markers(section, _NUMBERED)
+    if references is None:
+        references = _split_author_year(section)
+    references = [_SPACE.sub(' ', ref).strip() for ref in references]
+    return [ref for ref in references if MIN_LENGTH <= len(ref) <= MAX_LENGTH]
+
+
+def extract(path: str) -> list[str] | None:
+    """
+    :return: the references of the pdf at path, None if it has no
+        references section.
+    """
+    text = pdf_text(path)
+    section = references_section(text)
+    if section is None:
+        return None
+    return split_references(section)
+
+
+def _cache_file(sha256: str) -> str:
+    return os.path.join(CACHE_DIR, sha256 + '.json')
+
+
+def extract_cached(path: str) -> tuple[str, list[str] | None, bool]:
+    """
+    :return: the status ('ok', 'no references' or the error
+        extraction failed with), the references of path (None unless
+        ok), and whether they were cached.
+    """
+    sha256 = _sha256(path)
+    cache = _cache_file(sha256)
+    if os.path.exists(cache):
+        with open(cache, 'r', encoding='utf-8') as fobj:
+            obj = json.load(fobj)
+        if obj['version'] == VERSION:
+            references = obj['references']
+            return ('ok' if references is not None else 'no references'), references, True
+    try:
+        references = extract(path)
+    except Exception as e:
+        # not cached: may be a missing tool or a timeout.
+        return str(e), None, False
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    tmp = f"{cache}.{os.getpid()}.tmp"
+    with open(tmp, 'w', encoding='utf-8') as fobj:
+        json.dump({'version': VERSION, 'references': references}, fobj, ensure_ascii=False)
+    os.replace(tmp, cache)
+    return ('ok' if references is not None else 'no references'), references, False
+
+
+def _extract_file(path: str) -> tuple[str, str, list[str] | None, bool]:
+    return (path, *extract_cached(path))
+
+
+if __name__ == "__main__":
+    args = sys.argv
+    if len(args) not in (2, 3):
+        print("Usage: pdfrefs.py <save dir> [bibsource]", file=sys.stderr)
+        exit(1)
+
+    pdfs = sorted(glob.glob(os.path.join(args[1], '*.pdf')))
+    entries = dict()
+    if len(args) == 3:
+        entries = {entry['ID']: entry for entry in bibload.load(args[2]).entries}
+
+    logfile = open("pdfrefs.log", 'w')
+    reffile = open("pdfrefs.txt", 'w', encoding='utf-8')
+    pagefile = open("pdfrefs.jsonl", 'w', encoding='utf-8') if entries else None
+
+    found = cached = failed = total = 0
+    with Pool(int(os.environ.get('PROCESSES', '8'))) as workers:
+        for path, status, references, hit in workers.imap(_extract_file, pdfs):
+            key = os.path.splitext(os.path.basename(path))[0]
+            cached += hit
+            if references is None:
+                if status == 'no references':
+                    logfile.write(f"No reference section: {key}\n")
+                else:
+                    logfile.write(f"Failed: {key}: {status}\n")
+                    failed += 1
+                continue
+            if len(references) == 0:
+                logfile.write(f"No reference: {key}\n")
+            found += 1
+            total += len(references)
+            for ref in references:
+                reffile.write(ref + "\n")
+            if pagefile is not None and key in entries:
+                pagefile.write(page_record(entries[key], references) + "\n")
+
+    logfile.close()
+    reffile.close()
+    if pagefile is not None:
+        pagefile.close()
+    print(f"{total} references from {found}/{len(pdfs)} pdfs ({cached} cached, "
+          f"{failed} failed, see pdfrefs.log)", file=sys.stderr)
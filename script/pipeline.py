@@ -0,0 +1,318 @@
+"""
+SYNOPSIS
+    pipeline.py <bibfile> <save dir>
+
+DESCRIPTION
+    Snowball the arXiv entries of bibfile in one run, instead of
+    chaining arxiv.py, snowball.py, scholar.py and download.py by hand:
+
+        fetch     references of each seed (ArXiv.fetch_references)
+        classify  each new reference with the chat model (as snowball.py)
+        resolve   relevant titles to bibtex (local index, else export_bibtex,
+                  one Google Scholar query at a time)
+        download  the pdf of resolved entries having a link (download_paper)
+
+    Stages run at the same time, each with its own worker threads,
+    and hand items over through bounded queues: a stage blocks when
+    the next one falls QUEUE_SIZE items behind, so a relevant
+    reference is downloaded while other seeds are still fetched,
+    without piling up unbounded work.
+
+    Outputs are the ones of the separate scripts: result.jsonl,
+    failed.log (references the chat model failed on, to retry with
+    snowball.py --replay), technical.bib, survey.bib, benchmark.bib,
+    and {save dir}/{ID}.pdf with its manifest.json.
+
+ENVIRONMENT
+    API_KEY, MODEL, BASE_URL, WORKERS, RPM, TPM, CACHE, CACHE_MAX_ENTRIES,
+    CACHE_MAX_AGE, PREFILTER: as in snowball.py
+    BROWSERS: as in browserpool.py, also the number of resolving threads
+    SCHOLAR_DELAY: min seconds between the start of two Google Scholar
+        queries (default: 10)
+    FETCHERS: number of seeds fetched at the same time (default: 4)
+    JOBS: number of downloads running at the same time (default: 4)
+    QUEUE_SIZE: max number of items waiting between two stages (default: 64)
+
+SEE ALSO
+    snowball.py(1)
+    scholar.py(1)
+    download.py(1)
+"""
+import json
+import os
+import sys
+import threading
+import time
+import bibtexparser
+from bibtexparser.bibdatabase import BibDatabase
+from queue import Queue
+from typing import Callable, Iterable
+
+import bibload
+from arxiv import ArXiv
+from download import Manifest, download_paper
+from throttle import DomainScheduler, domain_name
+from llmcache import ResponseCache, normalize_reference
+from prefilter import Prefilter
+from scholar import browser_pool, export_bibtex
+from snowball import Classifier, sane_environ
+from titleindex import TitleIndex, build_index, normalize_title
+
+CATEGORIES = ['technical', 'survey', 'benchmark']
+
+# put in a queue once per worker of the next stage, to stop it.
+_DONE = None
+
+
+class Stage():
+    """
+    Worker threads applying func to each item of inbox, and putting
+    the items it yields into outbox (blocking while outbox is full).
+    """
+    def __init__(self, name: str, func: Callable[..., Iterable], workers: int,
+                 inbox: Queue, outbox: Queue | None):
+        self.name = name
+        self.func = func
+        self.inbox = inbox
+        self.outbox = outbox
+        self.lock = threading.Lock()
+        self.stats = {'in': 0, 'out': 0, 'failed': 0}
+        self.threads = [threading.Thread(target=self._run, daemon=True)
+                        for _ in range(max(1, workers))]
+
+    def _run(self) -> None:
+        while True:
+            item = self.inbox.get()
+            if item is _DONE:
+                return
+            produced = 0
+            failed = 0
+            try:
+                for out in self.func(item):
+                    if self.outbox is not None:
+                        self.outbox.put(out)
+                    produced += 1
+            except Exception as e:
+                print(f"{self.name}: {e}", file=sys.stderr)
+                failed = 1
+            with self.lock:
+                self.stats['in'] += 1
+                self.stats['out'] += produced
+                self.stats['failed'] += failed
+
+    def start(self) -> None:
+        for thread in self.threads:
+            thread.start()
+
+    def close(self) -> None:
+        """
+        Let the workers finish the items already queued, then stop them.
+        """
+        for _ in self.threads:
+            self.inbox.put(_DONE)
+        for thread in self.threads:
+            thread.join()
+
+    def report(self) -> str:
+        return f"{self.name:<8} {self.stats['in']:>6} in {self.stats['out']:>6} out " \
+               f"{self.stats['failed']:>4} failed"
+
+
+class Pipeline():
+    def __init__(self, savedir: str | None, **kwargs):
+        """
+        :param: classifier: the chat model.
+        :param: cache: cached answers of the chat model, optional.
+        :param: prefilter: drop clearly irrelevant references, optional.
+        :param: index: local bibtex entries, optional.
+        :param: fetchers, workers, resolvers, jobs: threads of each stage.
+        :param: scholar_delay: min seconds between two Google Scholar
+            queries (default 10).
+        :param: queue_size: capacity of each queue.
+        """
+        self.savedir = savedir
+        if savedir:
+            os.makedirs(savedir, exist_ok=True)
+        self.classifier: Classifier = kwargs['classifier']
+        self.cache: ResponseCache | None = kwargs.get('cache', None)
+        self.prefilter: Prefilter | None = kwargs.get('prefilter', None)
+        self.index: TitleIndex | None = kwargs.get('index', None)
+        self.manifest = Manifest(savedir)
+        self.scheduler = DomainScheduler()
+        # resolvers mostly hit the local index; Scholar is queried
+        # one title at a time, like scholar.py does.
+        self.scholar = DomainScheduler(1, kwargs.get('scholar_delay', 10.0))
+        self.lock = threading.Lock()
+        self.seen_references: set[str] = set()
+        self.seen_titles: set[str] = set()
+        self.result = open("result.jsonl", 'a', encoding='utf-8')
+        self.failure_log = open("failed.log", 'a', encoding='utf-8')
+        self.bibfiles = {k: open(k + '.bib', 'a', encoding='utf-8') for k in CATEGORIES}
+
+        size = kwargs.get('queue_size', 64)
+        queues = [Queue(size) for _ in range(4)]
+        self.seeds = queues[0]
+        self.stages = [
+            Stage('fetch', self.fetch, kwargs.get('fetchers', 4), queues[0], queues[1]),
+            Stage('classify', self.classify, kwargs.get('workers', 1), queues[1], queues[2]),
+            Stage('resolve', self.resolve, kwargs.get('resolvers', 1), queues[2], queues[3]),
+            Stage('download', self.download, kwargs.get('jobs', 4), queues[3], None),
+        ]
+
+    def fetch(self, article_id: str) -> Iterable[str]:
+        references = ArXiv.fetch_references(article_id)
+        print(f"{article_id}: {len(references)} references", file=sys.stderr)
+        return references
+
+    def classify(self, reference: str) -> Iterable[tuple[str, str]]:
+        key = normalize_reference(reference)
+        with self.lock:
+            if key in self.seen_references:
+                return
+            self.seen_references.add(key)
+        result = None
+        if self.cache is not None:
+            result = self.cache.get(self.classifier.cache_key(reference))
+        if result is None:
+            if self.prefilter is not None and self.prefilter.drop(reference):
+                return
+            try:
+                result = json.dumps(self.classifier.classify(reference))
+            except Exception:
+                with self.lock:
+                    self.failure_log.write(reference.strip() + '\n')
+                    self.failure_log.flush()
+                raise
+            if self.cache is not None:
+                self.cache.put(self.classifier.cache_key(reference), result)
+        record = json.loads(result)
+        with self.lock:
+            if isinstance(record, dict):
+                self.result.write(json.dumps({**record, 'reference': reference.strip()}) + '\n')
+            else:
+                self.result.write(result + '\n')
+            self.result.flush()
+        if isinstance(record, dict) and record.get('category', None) in CATEGORIES \
+                and 'title' in record:
+            yield record['category'], str(record['title'])
+
+    def resolve(self, item: tuple[str, str]) -> Iterable[tuple[str, str]]:
+        category, title = item
+        key = normalize_title(title)
+        with self.lock:
+            if key in self.seen_titles:
+                return
+            self.seen_titles.add(key)
+        entry = self.index.lookup(title) if self.index is not None else None
+        if entry is not None:
+            biblib = BibDatabase()
+            biblib.entries = [dict(entry)]
+            bibtex = bibtexparser.dumps(biblib)
+        else:
+            bibtex = self._export_bibtex(title)
+            if bibtex is None:
+                return
+            entry = next(iter(bibtexparser.loads(bibtex).entries), None)
+        with self.lock:
+            self.bibfiles[category].write(bibtex + '\n')
+            self.bibfiles[category].flush()
+        if entry is None or 'ID' not in entry:
+            return
+        if 'url' in entry:
+            yield entry['ID'], entry['url']
+        elif 'doi' in entry:
+            yield entry['ID'], 'https://doi.org/' + entry['doi']
+        elif 'eprint' in entry:
+            yield entry['ID'], 'https://arxiv.org/abs/' + entry['eprint']
+
+    def _export_bibtex(self, title: str) -> str | None:
+        # a single domain: the scheduler only decides when the next
+        # query may start, each worker exports its own title.
+        self.scholar.put('scholar.google.com', title)
+        job = self.scholar.get()
+        if job is None:
+            return None
+        try:
+            return export_bibtex(title)
+        finally:
+            self.scholar.done(job[0])
+
+    def download(self, item: tuple[str, str]) -> Iterable:
+        key, url = item
+        ofile = os.path.join(self.savedir, f"{key}.pdf") if self.savedir else f"{key}.pdf"
+        record = self.manifest.get(key)
+        if record is not None and record['status'] == 'ok' and os.path.exists(ofile):
+            return ()
+        # each worker queues its item, then takes whichever item
+        # DomainScheduler allows next, so no domain is hammered.
+        self.scheduler.put(domain_name(url), (key, url, ofile))
+        job = self.scheduler.get()
+        if job is None:
+            return ()
+        domain, (key, url, ofile) = job
+        try:
+            info = download_paper(url, ofile)
+        finally:
+            self.scheduler.done(domain)
+        if info is None:
+            self.manifest.failed(key, url)
+            raise RuntimeError(f"failed to download {url}")
+        self.manifest.update(key, info)
+        return ()
+
+    def run(self, seeds: list[str]) -> None:
+        start_time = time.time()
+        for stage in self.stages:
+            stage.start()
+        for seed in seeds:
+            self.seeds.put(seed)
+        # stop the stages in order, each once its upstream is drained.
+        for stage in self.stages:
+            stage.close()
+        elapsed = time.time() - start_time
+
+        self.result.close()
+        self.failure_log.close()
+        self.manifest.close()
+        for fobj in self.bibfiles.values():
+            fobj.close()
+        browser_pool().close()
+        for stage in self.stages:
+            print(stage.report(), file=sys.stderr)
+        print(f"{len(seeds)} seeds in {elapsed:.1f} s", file=sys.stderr)
+        if self.cache is not None:
+            print(self.cache.stats(), file=sys.stderr)
+        if self.index is not None:
+            print(self.index.stats(), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    sane_environ()
+    args = sys.argv
+    if len(args) != 3:
+        print("Usage: pipeline.py <bibfile> <save dir>", file=sys.stderr)
+        sys.exit(1)
+
+    lib = bibload.load(args[1])
+    seeds = [entry['eprint'] for entry in lib.entries if 'eprint' in entry]
+    cache = None
+    if os.environ.get('CACHE', 'snowball.sqlite') != '':
+        cache = ResponseCache(os.environ.get('CACHE', 'snowball.sqlite'),
+                              int(os.environ.get('CACHE_MAX_ENTRIES', '100000')),
+                              float(os.environ.get('CACHE_MAX_AGE', '30')) * 24 * 3600)
+    pipeline = Pipeline(args[2],
+                        classifier = Classifier(rpm = float(os.environ.get('RPM', '60')),
+                                                tpm = float(os.environ.get('TPM', '0'))),
+                        cache = cache,
+                        prefilter = Prefilter.load(os.environ['PREFILTER'])
+                            if os.environ.get('PREFILTER', '') != '' else None,
+                        index = build_index(),
+                        fetchers = int(os.environ.get('FETCHERS', '4')),
+                        workers = int(os.environ.get('WORKERS', '1')),
+                        resolvers = browser_pool().size,
+                        scholar_delay = float(os.environ.get('SCHOLAR_DELAY', '10')),
+                        jobs = int(os.environ.get('JOBS', '4')),
+                        queue_size = int(os.environ.get('QUEUE_SIZE', '64')))
+    pipeline.run(seeds)
+    if cache is not None:
+        cache.close()
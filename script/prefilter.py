@@ -0,0 +1,185 @@
+"""
+SYNOPSIS
+    prefilter.py <model.json> <snowball_result.jsonl>...
+
+DESCRIPTION
+    Train an offline relevance scorer on the labels of previous
+    snowballing runs, so that snowball.py can drop references that
+    are clearly irrelevant without asking the chat model.
+
+    The scorer is a logistic regression over hashed word unigrams
+    and bigrams of the title part of the raw reference, as snowball.py
+    sees it (results without the raw reference fall back to the title
+    given by the model). The labels are split into train (3/5),
+    calibration (1/5) and test (1/5) sets. The drop threshold is the
+    highest score keeping the false-negative rate (relevant references
+    that would be dropped) under MAX_FN on the calibration set; the
+    false-negative rate reported is measured on the test set.
+
+ENVIRONMENT
+    MAX_FN: max false-negative rate on the calibration set (default: 0.02)
+
+SEE ALSO
+    snowball.py(1)
+"""
+import json
+import math
+import os
+import random
+import sys
+import zlib
+
+from dedup import normalize, title_part
+
+
+def features(text: str, bits: int) -> list[int]:
+    words = normalize(text).split()
+    grams = words + [a + ' ' + b for a, b in zip(words, words[1:])]
+    mask = (1 << bits) - 1
+    return sorted(set(zlib.crc32(g.encode('utf-8')) & mask for g in grams))
+
+
+class Prefilter():
+    def __init__(self, bits: int = 18):
+        self.bits = bits
+        self.weights: dict[int, float] = dict()
+        self.bias = 0.0
+        self.threshold = 0.0
+        self.fn_rate = 0.0
+        self.dropped = 0
+
+    def score(self, text: str) -> float:
+        """
+        Estimated probability that the article titled text is relevant.
+        """
+        z = self.bias + sum(self.weights.get(f, 0.0) for f in features(text, self.bits))
+        z = max(-30.0, min(30.0, z))
+        return 1.0 / (1.0 + math.exp(-z))
+
+    def drop(self, reference: str) -> bool:
+        """
+        Whether the raw reference string is clearly irrelevant.
+        """
+        if self.score(title_part(reference)) < self.threshold:
+            self.dropped += 1
+            return True
+        return False
+
+    def fit(self, samples: list[tuple[str, bool]], epochs: int = 8,
+            rate: float = 0.2, l2: float = 1e-5) -> None:
+        """
+        :param: samples: (title, relevant) pairs.
+        """
+        positives = sum(1 for _, y in samples if y)
+        # relevant titles are rare, weight them up to balance both classes.
+        pos_weight = (len(samples) - positives) / positives if positives > 0 else 1.0
+        encoded = [(features(t, self.bits), y) for t, y in samples]
+        rng = random.Random(0)
+        for epoch in range(epochs):
+            rng.shuffle(encoded)
+            lr = rate / (1 + epoch)
+            for feats, y in encoded:
+                z = self.bias + sum(self.weights.get(f, 0.0) for f in feats)
+                z = max(-30.0, min(30.0, z))
+                p = 1.0 / (1.0 + math.exp(-z))
+                g = (p - 1.0) * pos_weight if y else p
+                for f in feats:
+                    w = self.weights.get(f, 0.0)
+                    self.weights[f] = w - lr * (g + l2 * w)
+                self.bias -= lr * g
+
+    def calibrate(self, samples: list[tuple[str, bool]], max_fn: float) -> None:
+        """
+        Pick the highest threshold whose false-negative rate on
+        held-out samples is at most max_fn.
+        """
+        scores = sorted(self.score(t) for t, y in samples if y)
+        if len(scores) == 0:
+            self.threshold = 0.0
+            return
+        self.threshold = scores[int(max_fn * len(scores))]
+
+    def evaluate(self, samples: list[tuple[str, bool]]) -> tuple[float, float]:
+        """
+        :return: the false-negative rate and the fraction of samples
+            dropped at the current threshold.
+        """
+        dropped = [y for t, y in samples if self.score(t) < self.threshold]
+        relevant = sum(1 for _, y in samples if y)
+        fn_rate = sum(dropped) / relevant if relevant > 0 else 0.0
+        return fn_rate, len(dropped) / max(1, len(samples))
+
+    def save(self, path: str) -> None:
+        with open(path, 'w', encoding='utf-8') as fobj:
+            json.dump({
+                'bits': self.bits,
+                'bias': self.bias,
+                'threshold': self.threshold,
+                'fn_rate': self.fn_rate,
+                'weights': {str(k): round(v, 6) for k, v in self.weights.items()},
+            }, fobj)
+
+    @staticmethod
+    def load(path: str) -> 'Prefilter':
+        with open(path, 'r', encoding='utf-8') as fobj:
+            obj = json.load(fobj)
+        ret = Prefilter(obj['bits'])
+        ret.bias = obj['bias']
+        ret.threshold = obj['threshold']
+        ret.fn_rate = obj['fn_rate']
+        ret.weights = {int(k): v for k, v in obj['weights'].items()}
+        return ret
+
+    def stats(self) -> str:
+        return f"Prefilter: {self.dropped} references dropped without a call, " \
+               f"estimated false-negative rate {self.fn_rate * 100:.1f}%"
+
+
+def load_labels(ifiles: list[str]) -> list[tuple[str, bool]]:
+    """
+    (text, relevant) pairs from snowball.py results, deduplicated by
+    text. text is the title part of the raw reference, what drop()
+    scores, or the model's title in results without the reference.
+    """
+    labels: dict[str, tuple[str, bool]] = dict()
+    for ifile in ifiles:
+        with open(ifile, 'r', encoding='utf-8') as fobj:
+            for line in fobj:
+                if len(line.strip()) == 0:
+                    continue
+                record = json.loads(line)
+                if not isinstance(record, dict) or 'title' not in record \
+                        or 'category' not in record:
+                    continue
+                text = title_part(record['reference']) if 'reference' in record \
+                    else str(record['title'])
+                labels[normalize(text)] = (text, record['category'] != 'irrelevant')
+    return list(labels.values())
+
+
+if __name__ == "__main__":
+    args = sys.argv
+    if len(args) < 3:
+        print("Usage: prefilter.py <model.json> <snowball_result.jsonl>...", file=sys.stderr)
+        sys.exit(1)
+
+    max_fn = float(os.environ.get('MAX_FN', '0.02'))
+    samples = load_labels(args[2:])
+    splits: tuple[list, list, list] = ([], [], [])
+    for s in samples:
+        # 0: test, 1: calibration, else train
+        splits[min(2, zlib.crc32(s[0].encode('utf-8')) % 5)].append(s)
+    test, calibration, train = splits
+
+    model = Prefilter()
+    model.fit(train)
+    model.calibrate(calibration, max_fn)
+    model.fn_rate, drop_rate = model.evaluate(test)
+    model.save(args[1])
+
+    relevant = sum(1 for _, y in test if y)
+    print(f"{len(train)} training, {len(calibration)} calibration, "
+          f"{len(test)} test references ({relevant} relevant)", file=sys.stderr)
+    print(f"threshold {model.threshold:.4f}: drops {drop_rate * 100:.1f}% "
+          f"of test references, false-negative rate {model.fn_rate * 100:.1f}%",
+          file=sys.stderr)
@@ -1,12 +1,21 @@
 """
 SYNOPSIS
     scholar.py <snowball_result.jsonl>
+    scholar.py --timing [n]
 
 DESCRIPTION
     Automate searching on Google scholar, bypassing cloudflare.
 
     It reads snowballing result, and try to search on Google Scholar
-    based on the collected article titles.
+    based on the collected article titles. Titles already in
+    ../dataset/*.bib or ../bibtex/*.bib are copied from there instead.
+    Titles already in the output files (technical.bib, survey.bib,
+    benchmark.bib) or repeated in the input are skipped, so an
+    interrupted run can simply be restarted.
+
+    With --timing, it exports n (default: 10) random titles of
+    ../bibtex/bench.bib and reports the p50/p95 latency of each
+    phase: launch, search, popup, bibtex (fetch) and parse.
 
 BUGS
     It is too slow, taking 30 seconds to export a single bibtex citation.
@@ -14,15 +23,21 @@ BUGS
 SEE ALSO
     scholar.js(file)
     snowball.py(1)
+    titleindex.py(1)
 """
 import os
 import time
 import random
 import sys
 import json
+from typing import Iterable, Iterator
 import bibtexparser
+import bibload
+import metrics
 from bibtexparser.bibdatabase import BibDatabase
 from seleniumbase import Driver
+from browserpool import BrowserPool, undetected_chrome, js_lib
+from titleindex import TitleIndex, build_index, normalize_title
 from bs4 import BeautifulSoup
 from urllib.parse import quote
 
@@ -30,28 +45,69 @@ def transform_url(txt: str) -> str:
     return quote(txt)
 
 
-def _js_lib() -> str:
-    with open("scholar.js", "r", encoding="utf-8") as f:
-        return f.read()
-
-
 def make_url(search_string: str) -> str:
     prefix = "https://scholar.google.com/scholar?hl=zh-CN&as_sdt=0%2C5&q="
     url = prefix + transform_url(search_string) + "&oq="
     return url
 
 
-def _invoke_browser(url: str) -> Driver:
-    driver = Driver(uc = True, headless=False)
-    driver.uc_open_with_reconnect(url, reconnect_time=10)
-    return driver
+# warm browsers reused across queries.
+_pool: BrowserPool | None = None
+
+
+def browser_pool() -> BrowserPool:
+    global _pool
+    if _pool is None:
+        _pool = BrowserPool(undetected_chrome)
+    return _pool
+
+
+def _wait_for(browser: Driver, script: str, timeout: float = 15, interval: float = 0.1):
+    """
+    Run script until it returns something else than null.
+
+    :return: the result of script, None on timeout.
+    """
+    deadline = time.monotonic() + timeout
+    while True:
+        result = browser.execute_script(script)
+        if result is not None or time.monotonic() >= deadline:
+            return result
+        time.sleep(interval)
+
 
+PHASES = ['launch', 'search', 'popup', 'bibtex', 'parse']
 
-def export_bibtex(query: str) -> str | None:
 
-    browser = _invoke_browser(make_url(query))
-    # browser.execute_script(_js_lib())
-    lib:str = _js_lib()
+def export_bibtex(query: str, timings: dict | None = None) -> str | None:
+    """
+    :param: timings: if given, filled with the seconds spent in each
+        of PHASES.
+    """
+    timings = dict() if timings is None else timings
+    search_url = make_url(query)
+    with metrics.timer('scholar.export', metrics.domain(search_url)):
+        clock = time.perf_counter()
+        browser = browser_pool().acquire()
+        timings['launch'] = time.perf_counter() - clock
+        failed = True
+        try:
+            ret = _export_bibtex(browser, search_url, timings)
+            failed = False
+            return ret
+        finally:
+            browser_pool().release(browser, failed)
+            for phase in PHASES:
+                if phase in timings:
+                    metrics.count('scholar.' + phase, metrics.domain(search_url),
+                                  ok=not failed, secs=timings[phase])
+
+
+def _export_bibtex(browser: Driver, search_url: str, timings: dict) -> str | None:
+    # browser.execute_script(js_lib('scholar.js'))
+    lib:str = js_lib('scholar.js')
+    clock = time.perf_counter()
+    browser.uc_open_with_reconnect(search_url, reconnect_time=10)
 
     # returns:
     # null if no result;
@@ -74,8 +130,8 @@ if (url == null) {
 return url + '\\n' + abstract;
 """
     abstract_and_url = browser.execute_script(script)
+    timings['search'] = time.perf_counter() - clock
     if abstract_and_url is None:
-        browser.quit()
         return None
 
     lines = abstract_and_url.split("\n", 1)
@@ -96,27 +152,28 @@ if (button) {
 
 return '';
 """
+    clock = time.perf_counter()
     result_exist = browser.execute_script(script)
     if result_exist is None:
-        browser.quit()
         return None
 
-    time.sleep(7)
-
+    # wait for the cite popup to show the BibTeX link.
     script = lib + \
 """
 first_result = locate_result();
 return export_bibtex_url(first_result);
 """
-    bibtex_url = browser.execute_script(script)
+    bibtex_url = _wait_for(browser, script)
+    timings['popup'] = time.perf_counter() - clock
     if bibtex_url is None:
-        browser.quit()
         return None
+    clock = time.perf_counter()
     browser.uc_open_with_reconnect(bibtex_url, reconnect_time=3)
 
     # extract bibtex inside <pre></pre>
     page_source = browser.page_source
-    browser.quit()
+    timings['bibtex'] = time.perf_counter() - clock
+    clock = time.perf_counter()
     soup = BeautifulSoup(page_source, "html.parser")
     pre = soup.find("pre")
     biblib: BibDatabase | None = None
@@ -135,15 +192,46 @@ return export_bibtex_url(first_result);
         biblib.entries[0]['abstract'] = abstract
     if 'url' not in biblib.entries[0] and url != '':
         biblib.entries[0]['url'] = url
-    return bibtexparser.dumps(biblib)
+    ret = bibtexparser.dumps(biblib)
+    timings['parse'] = time.perf_counter() - clock
+    return ret
 
 
-def download_bibtex_batch(records: list[dict], ofiles: None | dict):
+def read_records(path: str) -> Iterator[dict]:
+    """
+    Yield the records of a snowballing result one at a time.
     """
-    Download all references from records.
+    with open(path, 'r', encoding='utf-8') as fobj:
+        for line in fobj:
+            if len(line.strip()) == 0:
+                continue
+            yield json.loads(line)
+
 
-    :param: records: list of reference items, each contains key 'category', 'title'
+def exported_titles(bibfiles: Iterable[str]) -> set[str]:
+    """
+    :return: the normalized titles of the entries of bibfiles
+        (missing files are ignored).
+    """
+    titles: set[str] = set()
+    for bibfile in bibfiles:
+        if not os.path.exists(bibfile):
+            continue
+        for entry in bibload.iter_entries(bibfile, {'title'}):
+            if 'title' in entry:
+                titles.add(normalize_title(entry['title']))
+    return titles
+
+
+def download_bibtex_batch(records: Iterable[dict], ofiles: None | dict,
+                          index: TitleIndex | None = None):
+    """
+    Download all references from records, skipping titles already
+    in ofiles or seen earlier in records.
+
+    :param: records: reference items, each contains key 'category', 'title'
     :param: ofiles: open files for each type of reference.
+    :param: index: local entries emitted instead of searching Google Scholar.
     """
     all_categories = ['technical', 'survey', 'benchmark']
 
@@ -153,6 +241,10 @@ def download_bibtex_batch(records: list[dict], ofiles: None | dict):
         if k not in ofiles:
             ofiles[k] = k + '.bib'
 
+    seen = exported_titles(ofiles[k] for k in all_categories)
+    seen.discard('')
+    skipped = 0
+
     ofobjs = dict()
     for k in all_categories:
         ofobjs[k] = open(ofiles[k], 'a', encoding='utf-8')
@@ -167,6 +259,19 @@ def download_bibtex_batch(records: list[dict], ofiles: None | dict):
         if category not in all_categories:
             continue
         title = record['title']
+        key = normalize_title(title)
+        if key in seen:
+            skipped += 1
+            continue
+        if key != '':
+            seen.add(key)
+        entry = index.lookup(title) if index is not None else None
+        if entry is not None:
+            biblib = BibDatabase()
+            biblib.entries = [dict(entry)]
+            ofobjs[category].write(bibtexparser.dumps(biblib) + '\n')
+            ofobjs[category].flush()
+            continue
         try:
             bibtex = export_bibtex(title)
             if bibtex is not None:
@@ -187,13 +292,18 @@ def download_bibtex_batch(records: list[dict], ofiles: None | dict):
     # clean up ofiles
     for k in all_categories:
         ofobjs[k].close()
+    if _pool is not None:
+        _pool.close()
+    print(f"{skipped} queries skipped (already exported or duplicated)", file=sys.stderr)
+    if index is not None:
+        print(index.stats(), file=sys.stderr)
 
 
 def demo():
     # randomly select a title from ../bibtex/bench.bib
     random.seed(int(time.time()) % 97751)
     pth = os.path.join("..", "bibtex", "bench.bib")
-    biblib = bibtexparser.load(open(pth, encoding="utf-8"))
+    biblib = bibload.load(pth)
     titles = []
     for entry in biblib.entries:
         if 'title' in entry:
@@ -216,19 +326,51 @@ def demo():
             print(citation)
     except Exception as e:
         print(f"Error: {e}")
+    browser_pool().close()
+
+
+def timing(n: int):
+    """
+    Export n random titles of ../bibtex/bench.bib, and report the
+    p50/p95 latency of each phase of export_bibtex.
+    """
+    random.seed(int(time.time()) % 97751)
+    pth = os.path.join("..", "bibtex", "bench.bib")
+    biblib = bibload.load(pth)
+    titles = [entry['title'] for entry in biblib.entries if 'title' in entry]
+    del biblib
+
+    samples: dict[str, list[float]] = {phase: [] for phase in PHASES + ['total']}
+    found = 0
+    for query in random.sample(titles, min(n, len(titles))):
+        timings = dict()
+        start_time = time.perf_counter()
+        try:
+            if export_bibtex(query, timings) is not None:
+                found += 1
+        except Exception as e:
+            print(f"Error: {e}", file=sys.stderr)
+        timings['total'] = time.perf_counter() - start_time
+        for phase in timings:
+            samples[phase].append(timings[phase])
+        print(quote(query), ' '.join(f"{k}={v:.2f}s" for k, v in timings.items()),
+              file=sys.stderr)
+    browser_pool().close()
+
+    print(f"{found}/{len(samples['total'])} queries exported")
+    print(f"{'phase':<8} {'n':>4} {'p50':>8} {'p95':>8}")
+    for phase, values in samples.items():
+        print(f"{phase:<8} {len(values):>4} {metrics.percentile(values, 50):>7.2f}s {metrics.percentile(values, 95):>7.2f}s")
 
 
 if __name__ == "__main__":
     args = sys.argv
+    if len(args) in (2, 3) and args[1] == '--timing':
+        timing(int(args[2]) if len(args) == 3 else 10)
+        exit(0)
     if len(args) != 2:
         print("Usage: scholar.py <snowball_result.jsonl>", file=sys.stderr)
+        print("       scholar.py --timing [n]", file=sys.stderr)
         exit(1)
 
-    records = []
-    with open(args[1], 'r', encoding='utf-8') as fobj:
-        for line in fobj:
-            if len(line) == 0:
-                continue
-            records.append(json.loads(line))
-
-    download_bibtex_batch(records, None)
+    download_bibtex_batch(read_records(args[1]), None, build_index())
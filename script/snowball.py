@@ -1,31 +1,64 @@
 """
 SYNOPSIS
     snowball.py <reference-list>
+    snowball.py --replay
 
 DESCRIPTION
     After extracting the references of collected articles (provided
     in a text file; each line is a reference item),
     this script automatically query an chat model to categorize
     and filter articles referenced by the list.
+    Each answer (an Article, see article.ts) is appended to
+    result.jsonl with its raw reference line as 'reference'.
+
+    Handled lines are recorded in a checkpoint, so an interrupted run
+    resumes where it stopped; failed lines are appended to failed.log
+    and skipped, until retried on their own with --replay.
 
 ENVIRONMENT
     API_KEY (Required): your api key
     MODEL (Required): the chat model to use
     BASE_URL (Required): the base url of model provider
+    WORKERS: max number of requests in flight (default: 1)
+    RPM: requests per minute allowed by the provider (default: 60, 0 for no limit)
+    TPM: tokens per minute allowed by the provider (default: 0, no limit)
+    CACHE: sqlite file caching answers across runs (default: snowball.sqlite,
+        empty to disable)
+    CACHE_MAX_ENTRIES: max number of cached answers (default: 100000)
+    CACHE_MAX_AGE: drop cached answers older than that many days (default: 30)
+    BATCH: max number of references sent in one request (default: 1)
+    BATCH_TOKENS: max estimated prompt and answer tokens of a batched
+        request (default: 4000)
+    DEDUP: set to 1 to classify near-duplicate references only once
+        (default: 0)
+    PREFILTER: model trained by prefilter.py; references it scores as
+        clearly irrelevant are written to prefiltered.log without asking
+        the chat model (default: none)
+    CHECKPOINT: file recording handled lines (default: result.ckpt,
+        empty to always start from the first line)
 
 DEPENDENCY
     openai>=1.0
 
 SEE ALSO
     article.ts (file)
+    dedup.py(1)
+    prefilter.py(1)
 """
 
 import sys
 import time
 import os
 import json
+import threading
+import hashlib
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 
 from openai import OpenAI
+from llmcache import ResponseCache, normalize_reference
+from dedup import cluster
+from prefilter import Prefilter
+import metrics
 
 def sane_environ():
     def _raise_if_missing(key: str):
@@ -36,20 +69,17 @@ def sane_environ():
     _raise_if_missing('BASE_URL')
 
 
-def build_prompt(item: str) -> str:
-    BEFORE =  \
+_BACKGROUND = \
 """
 ## Background
 I'm a researcher conducting a Systematic Literature Review on
 Large Language Model for Automated Program Repair.
 
 ## Your Task
-Given the following reference item extracted from paper:
-"""
-    AFTER = \
 """
-Please read this carefully and find the title, authors, and year.
 
+_CRITERIA = \
+"""
 Next, please help me determine the relevance of this referenced article.
 If the article is not about program repair, bug fix, debugging, patch synthesis, or fault/bug localization,
 mark it as irrelevant. If the article is relevant to my study, judge its title
@@ -60,8 +90,10 @@ and categorize it into one of the following:
 **benchmark**: the article attempts to build a dataset/benchmark for program repair research.
 
 ## Output format
-Please generate json data satisfying the following TypeScript interface:
-```ts
+"""
+
+_INTERFACE = \
+"""```ts
 
 enum Category {
     Survey = 'survey',
@@ -79,71 +111,475 @@ interface Article {
 ``` 
 **do not provide extra explanations**, and **do not use ```json and ``` quotes**.
 """
+
+
+def build_prompt(item: str) -> str:
+    BEFORE = _BACKGROUND + \
+"""Given the following reference item extracted from paper:
+"""
+    AFTER = \
+"""
+Please read this carefully and find the title, authors, and year.
+""" + _CRITERIA + \
+"""Please generate json data satisfying the following TypeScript interface:
+""" + _INTERFACE
     return BEFORE + item + '\n\n' + AFTER
 
 
-def process_file(ifile: str, **kwargs) -> None:
-    client = OpenAI(
-            api_key = os.environ['API_KEY'],
-            base_url = os.environ['BASE_URL']
+def build_batch_prompt(items: list[str]) -> str:
+    """
+    A single prompt classifying all items; the answer is expected
+    to be a json array of Article, in the order of items.
+    """
+    BEFORE = _BACKGROUND + \
+f"""Given the following {len(items)} reference items extracted from paper,
+each starting with its index in brackets:
+"""
+    AFTER = \
+"""
+Please read each of them carefully and find the title, authors, and year.
+""" + _CRITERIA.replace('this referenced article', 'each referenced article') + \
+f"""Please generate a json array of exactly {len(items)} elements, the i-th element
+describing reference [i] and satisfying the following TypeScript interface:
+""" + _INTERFACE
+    body = ''.join(f"[{i + 1}] {item}\n" for i, item in enumerate(items))
+    return BEFORE + body + '\n' + AFTER
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Rough token count of text, about 4 characters per token.
+    """
+    return len(text) // 4 + 1
+
+
+class RateLimiter():
+    """
+    Token bucket limiting both requests per minute (rpm) and
+    tokens per minute (tpm). A limit of 0 means unlimited.
+    """
+    def __init__(self, rpm: float = 0, tpm: float = 0):
+        self.rpm = rpm
+        self.tpm = tpm
+        self._requests: float = rpm
+        self._tokens: float = tpm
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        elapsed = now - self._last
+        self._last = now
+        if self.rpm > 0:
+            self._requests = min(self.rpm, self._requests + elapsed * self.rpm / 60)
+        if self.tpm > 0:
+            self._tokens = min(self.tpm, self._tokens + elapsed * self.tpm / 60)
+
+    def acquire(self, tokens: int = 0) -> None:
+        """
+        Block until one request of (estimated) `tokens` tokens may be sent.
+        """
+        if self.tpm > 0:
+            tokens = min(tokens, self.tpm)
+        while True:
+            with self._lock:
+                self._refill()
+                delay = 0.0
+                if self.rpm > 0 and self._requests < 1:
+                    delay = max(delay, (1 - self._requests) * 60 / self.rpm)
+                if self.tpm > 0 and self._tokens < tokens:
+                    delay = max(delay, (tokens - self._tokens) * 60 / self.tpm)
+                if delay == 0.0:
+                    if self.rpm > 0:
+                        self._requests -= 1
+                    if self.tpm > 0:
+                        self._tokens -= tokens
+                    return
+            time.sleep(delay)
+
+    def settle(self, estimated: int, actual: int) -> None:
+        """
+        Correct the token bucket once the real usage of a request is known.
+        """
+        if self.tpm <= 0:
+            return
+        with self._lock:
+            self._tokens -= actual - estimated
+
+
+class Classifier():
+    """
+    Thread-safe wrapper around the chat model, sending one
+    prompt per call under a shared rate limiter.
+    """
+    # budget reserved for the answer of a single reference.
+    RESPONSE_TOKENS = 100
+
+    def __init__(self, **kwargs):
+        self.client = OpenAI(
+                api_key = os.environ['API_KEY'],
+                base_url = os.environ['BASE_URL']
+                )
+        self.model: str = os.environ['MODEL']
+        self.temperature: float = kwargs['temperature'] if 'temperature' in kwargs else 0.6
+        self.limiter: RateLimiter = kwargs['limiter'] if 'limiter' in kwargs \
+            else RateLimiter(kwargs.get('rpm', 60), kwargs.get('tpm', 0))
+
+        if 'message' in kwargs:
+            self.message = kwargs['message']
+        else:
+            system_prompt = "You are a helpful assistant."
+            if 'system' in kwargs:
+                system_prompt = kwargs['system']
+            self.message = [
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": None}
+            ]
+        self.template_hash: str = self.fingerprint()
+
+    def complete(self, prompt: str, response_tokens: int = RESPONSE_TOKENS) -> str:
+        message = [dict(m) for m in self.message]
+        message[-1]['content'] = prompt
+        estimated = sum(estimate_tokens(m['content']) for m in message) + response_tokens
+        self.limiter.acquire(estimated)
+        with metrics.timer('llm', self.model) as event:
+            completion = self.client.chat.completions.create(
+                model = self.model,
+                messages = message,
+                temperature = self.temperature
             )
+            usage = getattr(completion, 'usage', None)
+            if usage is not None:
+                event['prompt_tokens'] = usage.prompt_tokens
+                event['response_tokens'] = usage.completion_tokens
+        if usage is not None and usage.total_tokens:
+            self.limiter.settle(estimated, usage.total_tokens)
+        result: str = completion.choices[0].message.content
+        del completion
+        return result
+
+    def classify(self, item: str) -> dict:
+        return json.loads(self.complete(build_prompt(item)))
+
+    def classify_batch(self, items: list[str]) -> list[dict | Exception]:
+        """
+        Classify items with one request. If its answer cannot be parsed
+        or matched to the items by index, the batch is split in halves
+        and retried, down to single items. If the request itself fails
+        (rate limit, connection...), the whole batch fails: splitting
+        it would only send more requests to a provider refusing them.
+
+        :return: for each item, its Article or the error it failed with.
+        """
+        if len(items) == 1:
+            try:
+                return [self.classify(items[0])]
+            except Exception as e:
+                return [e]
+        try:
+            result = self.complete(build_batch_prompt(items),
+                                   len(items) * Classifier.RESPONSE_TOKENS)
+        except Exception as e:
+            return [e] * len(items)
+        try:
+            # json.JSONDecodeError is a ValueError.
+            objs = json.loads(result)
+            if not isinstance(objs, list) or len(objs) != len(items) \
+                    or not all(isinstance(obj, dict) for obj in objs):
+                raise ValueError(f"expected a json array of {len(items)} articles")
+            return objs
+        except ValueError as e:
+            print(f"Splitting batch of {len(items)}: {e}", file=sys.stderr)
+        mid = len(items) // 2
+        return self.classify_batch(items[:mid]) + self.classify_batch(items[mid:])
+
+    def batch_overhead(self) -> int:
+        """
+        Estimated tokens of a batch request, excluding the items.
+        """
+        return sum(estimate_tokens(str(m['content'])) for m in self.message[:-1]) \
+            + estimate_tokens(build_batch_prompt([]))
+
+    def fingerprint(self) -> str:
+        """
+        Hash of the prompt template, used as part of the cache key.
+        """
+        h = hashlib.sha256()
+        for m in self.message[:-1]:
+            h.update(str(m['content']).encode('utf-8'))
+        h.update(build_prompt('').encode('utf-8'))
+        return h.hexdigest()
+
+    def cache_key(self, item: str) -> str:
+        return ResponseCache.make_key(item, self.model, self.temperature,
+                                      self.template_hash)
+
+
+class Checkpoint():
+    """
+    Append-only record of the input lines already handled, keyed by
+    the hash of the normalized line. Each line of the file is
+    `ok <hash>`, `failed <hash>` or `dropped <hash>` (by the
+    prefilter); the last status wins.
+    """
+    def __init__(self, path: str):
+        self.status: dict[str, str] = dict()
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as fobj:
+                for line in fobj:
+                    toks = line.split()
+                    if len(toks) == 2:
+                        self.status[toks[1]] = toks[0]
+        self.fobj = open(path, 'a', encoding='utf-8')
+
+    @staticmethod
+    def digest(item: str) -> str:
+        return hashlib.sha1(normalize_reference(item).encode('utf-8')).hexdigest()
+
+    def done(self, item: str, replay: bool = False) -> bool:
+        """
+        Whether item can be skipped. When replaying failures,
+        only failed lines are retried.
+        """
+        status = self.status.get(Checkpoint.digest(item), None)
+        if replay:
+            return status in ('ok', 'dropped')
+        return status is not None
+
+    def mark(self, item: str, ok: bool) -> None:
+        self._write(item, 'ok' if ok else 'failed')
+
+    def drop(self, item: str) -> None:
+        self._write(item, 'dropped')
 
-    temperature: float = kwargs['temperature'] if 'temperature' in kwargs else 0.6
+    def _write(self, item: str, status: str) -> None:
+        key = Checkpoint.digest(item)
+        self.status[key] = status
+        self.fobj.write(f"{status} {key}\n")
+        self.fobj.flush()
 
-    if 'message' in kwargs:
-        message = kwargs['message']
-    else:
-        system_prompt = "You are a helpful assistant."
-        if 'system' in kwargs:
-            system_prompt = kwargs['system']
-        message = [
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": None}
-        ]
+    def close(self) -> None:
+        self.fobj.close()
 
-    failure_log = open("failed.log", 'w', encoding='utf-8')
+
+def read_groups(ifile: str, dedup: bool = False):
+    """
+    Yield the non-empty lines of ifile as lists of duplicates, the
+    first one being the representative sent to the model. Without
+    dedup, each line is its own group.
+    """
+    with open(ifile, 'r', encoding='utf-8') as fobj:
+        if not dedup:
+            for item in fobj:
+                if len(item.strip()) == 0:
+                    continue
+                yield [item if item.endswith('\n') else item + '\n']
+            return
+        items = [item if item.endswith('\n') else item + '\n'
+                 for item in fobj if len(item.strip()) > 0]
+    clusters = cluster(items)
+    print(f"{len(items)} references, {len(clusters)} clusters", file=sys.stderr)
+    for rep in clusters:
+        yield [items[idx] for idx in clusters[rep]]
+
+
+def process_file(ifile: str, **kwargs) -> bool:
+    """
+    Classify each line of ifile, appending results to result.jsonl
+    and failed lines to failed.log.
+
+    :param: workers: max number of requests in flight (default 1).
+    :param: rpm, tpm: requests/tokens per minute (default 60 rpm, no tpm limit).
+    :param: cache: a ResponseCache serving already classified references.
+    :param: checkpoint: a Checkpoint; lines recorded in it are skipped,
+        and failed.log is appended to instead of truncated.
+    :param: replay: retry lines recorded as failed in the checkpoint.
+    :param: batch_size: max number of references per request (default 1).
+    :param: batch_tokens: max estimated tokens per batched request (default 4000).
+    :param: dedup: classify one representative per cluster of near-duplicate
+        references, and copy its answer to the other members.
+    :param: prefilter: a Prefilter; references it drops are written to
+        prefiltered.log instead of being sent to the model.
+    :return: whether every line was handled, i.e. it did not stop on
+        too many failures.
+    """
+    classifier = Classifier(**kwargs)
+    workers: int = max(1, kwargs.get('workers', 1))
+    cache: ResponseCache | None = kwargs.get('cache', None)
+    checkpoint: Checkpoint | None = kwargs.get('checkpoint', None)
+    replay: bool = kwargs.get('replay', False)
+    batch_size: int = max(1, kwargs.get('batch_size', 1))
+    batch_tokens_limit: int = kwargs.get('batch_tokens', 4000)
+    dedup: bool = kwargs.get('dedup', False)
+    prefilter: Prefilter | None = kwargs.get('prefilter', None)
+
+    failure_log = open("failed.log", 'w' if checkpoint is None else 'a', encoding='utf-8')
     ofile = open("result.jsonl", "a", encoding='utf-8')
+    dropped_log = open("prefiltered.log", 'a', encoding='utf-8') if prefilter is not None else None
     failure_tol = 5
     num_failed = 0
-    with open(ifile, 'r', encoding='utf-8') as fobj:
-        for item in fobj:
-            if len(item) == 0:
-                continue
-            message[1]['content']  = build_prompt(item.strip())
-            success = False
-            try:
-                completion = client.chat.completions.create(
-                    model = os.environ['MODEL'],
-                    messages = message,
-                    temperature = temperature
-                )
-                result: str = completion.choices[0].message.content
-                del completion
+    futures = dict()
+    pending = set()
+    stop = False
 
-                obj: dict = json.loads(result)
-                ofile.write(json.dumps(obj) + '\n')
-                ofile.flush()
-                success = True
+    def _succeed(members: list[str], result: str) -> None:
+        # the answer for the representative fans out to all members,
+        # each with its own raw reference (prefilter.py trains on it).
+        record = json.loads(result)
+        for item in members:
+            if isinstance(record, dict):
+                record['reference'] = item.strip()
+                result = json.dumps(record)
+            ofile.write(result + '\n')
+            if checkpoint is not None:
+                checkpoint.mark(item, True)
+        ofile.flush()
+
+    def _collect(done) -> None:
+        nonlocal num_failed, stop
+        for future in done:
+            pending.discard(future)
+            groups: list[list[str]] = futures[future]
+            del futures[future]
+            try:
+                results = future.result()
             except Exception as e:
-                print(e, file=sys.stderr)
-                failure_log.write(item)
+                results = [e] * len(groups)
+            for members, obj in zip(groups, results):
+                if not isinstance(obj, Exception):
+                    result = json.dumps(obj)
+                    _succeed(members, result)
+                    if cache is not None:
+                        for item in members:
+                            cache.put(classifier.cache_key(item), result)
+                    num_failed = 0
+                    continue
+                print(obj, file=sys.stderr)
+                for item in members:
+                    failure_log.write(item)
+                    if checkpoint is not None:
+                        checkpoint.mark(item, False)
                 failure_log.flush()
                 num_failed += 1
-                if num_failed > failure_tol:
+                if num_failed > failure_tol and not stop:
                     print("Too many failures, stop processing.", file=sys.stderr)
-                    break
-            if success:
-                num_failed = 0
-            time.sleep(1) # avoid hitting rate limit
+                    stop = True
+
+    def _submit(executor, batch: list[list[str]]) -> None:
+        future = executor.submit(classifier.classify_batch,
+                                 [members[0].strip() for members in batch])
+        futures[future] = batch
+        pending.add(future)
+        # keep a bounded number of requests in flight.
+        if len(pending) >= 2 * workers:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            _collect(done)
+
+    overhead = classifier.batch_overhead()
+    batch: list[list[str]] = []
+    batch_tokens = overhead
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for members in read_groups(ifile, dedup):
+            if stop:
+                break
+            if checkpoint is not None:
+                members = [item for item in members if not checkpoint.done(item, replay)]
+                if len(members) == 0:
+                    continue
+            item = members[0]
+            if cache is not None:
+                result = cache.get(classifier.cache_key(item))
+                if result is not None:
+                    _succeed(members, result)
+                    continue
+            if prefilter is not None and prefilter.drop(item):
+                dropped_log.writelines(members)
+                dropped_log.flush()
+                if checkpoint is not None:
+                    for member in members:
+                        checkpoint.drop(member)
+                continue
+            # batch size adapts to the token budget of a request.
+            tokens = estimate_tokens(item) + Classifier.RESPONSE_TOKENS
+            if len(batch) > 0 and (len(batch) >= batch_size
+                                   or batch_tokens + tokens > batch_tokens_limit):
+                _submit(executor, batch)
+                batch = []
+                batch_tokens = overhead
+            batch.append(members)
+            batch_tokens += tokens
+        if len(batch) > 0 and not stop:
+            _submit(executor, batch)
+        if stop:
+            for future in pending:
+                future.cancel()
+        done, _ = wait(pending)
+        _collect([f for f in done if not f.cancelled()])
     ofile.close()
     failure_log.close()
+    if cache is not None:
+        print(cache.stats(), file=sys.stderr)
+    if prefilter is not None:
+        dropped_log.close()
+        print(prefilter.stats(), file=sys.stderr)
+    return not stop
 
 
 if __name__ == "__main__":
     sane_environ()
     args  = sys.argv    
     if len(args) != 2:
-        print("Usage: snowball.py <reference-list>", file=sys.stderr)
+        print("Usage: snowball.py <reference-list>|--replay", file=sys.stderr)
         sys.exit(1)
-    process_file(args[1])
+    checkpoint = None
+    if os.environ.get('CHECKPOINT', 'result.ckpt') != '':
+        checkpoint = Checkpoint(os.environ.get('CHECKPOINT', 'result.ckpt'))
+    ifile = args[1]
+    replay = ifile == '--replay'
+    if replay:
+        if checkpoint is None:
+            print("--replay requires a checkpoint.", file=sys.stderr)
+            sys.exit(1)
+        # new failures are appended to a fresh failed.log; lines left in
+        # failed.log.replay by an interrupted replay are retried as well.
+        ifile = 'failed.log.replay'
+        if os.path.exists('failed.log'):
+            pending = set()
+            if os.path.exists(ifile):
+                with open(ifile, 'r', encoding='utf-8') as fin:
+                    pending = set(fin)
+            with open('failed.log', 'r', encoding='utf-8') as fin, \
+                    open(ifile, 'a', encoding='utf-8') as fout:
+                for line in fin:
+                    if line not in pending:
+                        pending.add(line)
+                        fout.write(line)
+            os.unlink('failed.log')
+        if not os.path.exists(ifile):
+            print("Nothing to replay.", file=sys.stderr)
+            sys.exit(0)
+    cache = None
+    if os.environ.get('CACHE', 'snowball.sqlite') != '':
+        cache = ResponseCache(os.environ.get('CACHE', 'snowball.sqlite'),
+                              int(os.environ.get('CACHE_MAX_ENTRIES', '100000')),
+                              float(os.environ.get('CACHE_MAX_AGE', '30')) * 24 * 3600)
+    complete = process_file(ifile,
+                            workers = int(os.environ.get('WORKERS', '1')),
+                            rpm = float(os.environ.get('RPM', '60')),
+                            tpm = float(os.environ.get('TPM', '0')),
+                            cache = cache,
+                            checkpoint = checkpoint,
+                            replay = replay,
+                            batch_size = int(os.environ.get('BATCH', '1')),
+                            batch_tokens = int(os.environ.get('BATCH_TOKENS', '4000')),
+                            dedup = os.environ.get('DEDUP', '0') == '1',
+                            prefilter = Prefilter.load(os.environ['PREFILTER'])
+                                if os.environ.get('PREFILTER', '') != '' else None)
+    if cache is not None:
+        cache.close()
+    if checkpoint is not None:
+        checkpoint.close()
+    # after an early stop, the lines not retried yet stay in the replay file.
+    if replay and complete:
+        os.unlink(ifile)
 
@@ -0,0 +1,23 @@
+var export_references = function () {
+    var ret = [];
+    for (var id = 1; ; id++) {
+        var ref = document.querySelector("#ref-CR" + String(id));
+        if (ref == null) {
+            break;
+        }
+        var content = ref.textContent.trim();
+        if (content == '') {
+            break;
+        }
+        ret.push(content);
+    }
+    return ret;
+};
+
+// everything extracted from the page, in a single round trip.
+var export_page = function () {
+    var ret = page_metadata();
+    ret.references = export_references();
+    ret.cited_by = [];
+    return ret;
+};
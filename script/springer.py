@@ -1,71 +1,85 @@
+"""
+DESCRIPTION
+    Export the reference list of the articles in ../dataset/springer.bib
+    to springer.txt, starting at most one page every DELAY seconds.
+
+ENVIRONMENT
+    DELAY: min seconds between the start of two page loads (default: 1)
+"""
 import os
-import time
 import sys
-import bibtexparser
+import bibload
+import metrics
 from selenium import webdriver
-from selenium.webdriver.firefox.options import Options
+from browserpool import BrowserPool, headless_firefox, js_lib
+from throttle import scheduled_map
+from citegraph import page_record
 
 class Springer():
     @staticmethod
-    def _get_reference(browser: webdriver, id: int) -> str | None:
-        jsscript = """
-    var ref = document.querySelector("#ref-CR" + arguments[0]);
-    if (ref == null) {
-        return '';
-    }
-    var content = ref.textContent.trim();
-    return content;
-"""
-        result  = browser.execute_script(jsscript, str(id))
-        if result == '':
-            return None
-        return result
+    def get_page(browser: webdriver) -> dict:
+        """
+        References and metadata of the page, in a single round trip.
+
+        :return: dict with keys url, title, doi, references, cited_by.
+        """
+        with metrics.timer('execute_script', 'link.springer.com'):
+            return browser.execute_script(js_lib('springer.js') + "\nreturn export_page();")
 
     @staticmethod
     def get_references(browser: webdriver) -> list[str]:
-        id = 1
-        ret = []
-        while True:
-            ref = Springer._get_reference(browser, id)
-            if ref is None:
-                break
-            ret.append(ref)
-            id += 1
-        return ret
+        return Springer.get_page(browser)['references']
+
+
+def scrape(pool: BrowserPool, doi: str) -> list[str] | None:
+    """
+    :return: references of the article, None on error.
+    """
+    url = 'https://link.springer.com/article/' + doi
+    try:
+        with pool.lease() as browser:
+            with metrics.timer('page.load', metrics.domain(url)):
+                browser.get(url)
+            return Springer.get_references(browser)
+    except Exception as e:
+        print(e, file=sys.stderr)
+        return None
+
 
 if __name__ == "__main__":
-    myoptions = Options()
-    myoptions.add_argument("-headless") # Enable headless mode
+    pool = BrowserPool(headless_firefox)
 
     bibfile  = os.path.join("..", "dataset", "springer.bib")
-    lib = bibtexparser.load(open(bibfile, 'r'))
+    lib = bibload.load(bibfile)
     logfile = open("springer.log", 'w')
     reffile = open("springer.txt", 'w')
+    pagefile = open("springer.jsonl", 'w', encoding='utf-8')
 
-    for entry in lib.entries:
-        if 'doi' not in entry:
-            continue
-        doi  = entry['doi']
-        print(doi, file=sys.stderr)
-        url = 'https://link.springer.com/article/' + doi
-        references = []
-
-        browser = webdriver.Firefox(options=myoptions)
-        try:
-            browser.get(url)
-            references = Springer.get_references(browser)
-        except:
-            logfile.write(f"Error: {doi}\n")
-        browser.quit()
+    try:
+        entries = [entry for entry in lib.entries if 'doi' in entry]
+        dois = [entry['doi'] for entry in entries]
+        delay = float(os.environ.get('DELAY', '1'))
+        tasks = [('link.springer.com', doi) for doi in dois]
+        for entry, references in zip(entries, scheduled_map(lambda doi: scrape(pool, doi), tasks,
+                                                            pool.size, pool.size, delay)):
+            doi = entry['doi']
+            print(doi, file=sys.stderr)
+            if references is None:
+                logfile.write(f"Error: {doi}\n")
+                references = []
+            else:
+                pagefile.write(page_record(entry, references) + "\n")
+                pagefile.flush()
 
-        for ref in references:
-            reffile.write(ref + "\n")
-        if len(references) == 0:
-            logfile.write(f"No reference: {doi}\n")
-        reffile.flush()
-        time.sleep(1)
-        del references
-        del browser
+            for ref in references:
+                reffile.write(ref + "\n")
+            if len(references) == 0:
+                logfile.write(f"No reference: {doi}\n")
+            reffile.flush()
+            del references
+    finally:
+        pool.close()
 
     logfile.close()
+    pagefile.close()
     reffile.close()
@@ -0,0 +1,41 @@
+"""
+Run with: python -m unittest discover script/tests
+"""
+import os
+import pstats
+import subprocess
+import sys
+import tempfile
+import unittest
+
+SCRIPT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+THREADED = f"""
+import sys
+sys.path.insert(0, {SCRIPT_DIR!r})
+import metrics
+from concurrent.futures import ThreadPoolExecutor
+
+def work(n):
+    return sum(range(n))
+
+with ThreadPoolExecutor(max_workers=2) as executor:
+    print(sum(executor.map(work, [1000] * 8)))
+"""
+
+
+class ProfileTest(unittest.TestCase):
+    def test_threads_run_and_are_profiled(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'run.prof')
+            proc = subprocess.run([sys.executable, '-c', THREADED],
+                                  env={**os.environ, 'PROFILE': path},
+                                  capture_output=True, text=True, timeout=60)
+            self.assertEqual(proc.returncode, 0, proc.stderr)
+            self.assertEqual(proc.stdout.strip(), str(8 * sum(range(1000))))
+            functions = {func for _, _, func in pstats.Stats(path).stats}
+            self.assertIn('work', functions)
+
+
+if __name__ == "__main__":
+    unittest.main()
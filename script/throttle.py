@@ -0,0 +1,147 @@
+"""
+DESCRIPTION
+    Per-domain politeness shared by download.py, pipeline.py and the
+    scrapers (acm.py, springer.py, arxiv.py): at most a few requests
+    to one domain at once, started some seconds apart, while requests
+    to other domains proceed.
+
+SEE ALSO
+    download.py(1)
+"""
+import sys
+import threading
+import time
+
+
+def domain_name(url: str) -> str:
+    try:
+        idx = url.index('://')
+        url = url[idx+3:]
+    except ValueError:
+        pass
+    try:
+        idx = url.index('/')
+        url = url[:idx]
+    except ValueError:
+        pass
+    return url
+
+
+class DomainScheduler():
+    """
+    Hand out tasks to worker threads, so that at most
+    `per_domain` tasks of the same domain run at once, and
+    successive tasks of one domain start at least `delay`
+    seconds apart. Tasks of other domains are served meanwhile.
+    """
+    def __init__(self, per_domain: int = 1, delay: float = 10.0):
+        self.per_domain = per_domain
+        self.delay = delay
+        self.tasks: dict[str, list] = dict()
+        self.active: dict[str, int] = dict()
+        self.next_start: dict[str, float] = dict()
+        self.cond = threading.Condition()
+
+    def put(self, domain: str, task) -> None:
+        with self.cond:
+            self.tasks.setdefault(domain, []).append(task)
+            self.cond.notify()
+
+    def get(self):
+        """
+        Block until some domain may be fetched again.
+
+        :return: (domain, task), or None when no task is left.
+        """
+        with self.cond:
+            while True:
+                now = time.monotonic()
+                wakeup = None
+                for domain, tasks in self.tasks.items():
+                    if len(tasks) == 0 or self.active.get(domain, 0) >= self.per_domain:
+                        continue
+                    start = self.next_start.get(domain, now)
+                    if start <= now:
+                        self.active[domain] = self.active.get(domain, 0) + 1
+                        self.next_start[domain] = now + self.delay
+                        return domain, tasks.pop(0)
+                    wakeup = start if wakeup is None else min(wakeup, start)
+                if all(len(tasks) == 0 for tasks in self.tasks.values()):
+                    return None
+                self.cond.wait(None if wakeup is None else wakeup - now)
+
+    def done(self, domain: str) -> None:
+        with self.cond:
+            self.active[domain] -= 1
+            self.cond.notify_all()
+
+
+def _scheduled_run(func, tasks: list[tuple[str, object]], jobs: int, per_domain: int,
+                   delay: float):
+    """
+    :return: an iterator of (index in tasks, result), as tasks complete.
+    """
+    scheduler = DomainScheduler(per_domain, delay)
+    for i, (domain, task) in enumerate(tasks):
+        scheduler.put(domain, (i, task))
+    results: dict[int, object] = dict()
+    cond = threading.Condition()
+
+    def _worker():
+        while True:
+            job = scheduler.get()
+            if job is None:
+                return
+            domain, (i, task) = job
+            try:
+                result = func(task)
+            except Exception as e:
+                print(e, file=sys.stderr)
+                result = None
+            finally:
+                scheduler.done(domain)
+            with cond:
+                results[i] = result
+                cond.notify_all()
+
+    workers = [threading.Thread(target=_worker, daemon=True) for _ in range(max(1, jobs))]
+    for worker in workers:
+        worker.start()
+    for _ in range(len(tasks)):
+        with cond:
+            while len(results) == 0:
+                cond.wait()
+            i = next(iter(results))
+            result = results.pop(i)
+        yield i, result
+    for worker in workers:
+        worker.join()
+
+
+def scheduled_map(func, tasks: list[tuple[str, object]], jobs: int = 1,
+                  per_domain: int = 1, delay: float = 1.0):
+    """
+    Run func(task) for each (domain, task) of tasks in jobs threads,
+    under the politeness rules of a DomainScheduler.
+
+    :return: an iterator of the results, in the order of tasks
+        (None for a task that raised).
+    """
+    pending: dict[int, object] = dict()
+    next_index = 0
+    for i, result in _scheduled_run(func, tasks, jobs, per_domain, delay):
+        pending[i] = result
+        while next_index in pending:
+            yield pending.pop(next_index)
+            next_index += 1
+
+
+def scheduled_as_completed(func, tasks: list[tuple[str, object]], jobs: int = 1,
+                           per_domain: int = 1, delay: float = 1.0):
+    """
+    Same as scheduled_map, but yield results as soon as they are ready.
+
+    :return: an iterator of (task, result), in the order tasks complete.
+    """
+    for i, result in _scheduled_run(func, tasks, jobs, per_domain, delay):
+        yield tasks[i][1], result
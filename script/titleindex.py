@@ -0,0 +1,124 @@
+"""
+SYNOPSIS
+    titleindex.py <title>...
+
+DESCRIPTION
+    Index of the titles of local bibtex entries (../dataset/*.bib and
+    ../bibtex/*.bib), so that a title can be resolved to its entry
+    without searching Google Scholar.
+
+    A title matches an entry if their normalized titles are equal,
+    or if the Dice coefficient of their character trigrams is at
+    least the threshold.
+
+SEE ALSO
+    scholar.py(1)
+"""
+import glob
+import os
+import re
+import sys
+import bibload
+
+from dedup import normalize
+
+_LATEX_COMMAND = re.compile(r'\\[a-zA-Z]+\s*')
+
+
+def normalize_title(title: str) -> str:
+    """
+    Drop bibtex braces and latex commands, then normalize like dedup.py.
+    """
+    return normalize(_LATEX_COMMAND.sub(' ', title).replace('{', '').replace('}', ''))
+
+
+def trigrams(key: str) -> set[str]:
+    key = f"  {key} "
+    return set(key[i:i + 3] for i in range(len(key) - 2))
+
+
+class TitleIndex():
+    def __init__(self, threshold: float = 0.85):
+        """
+        :param: threshold: min trigram Dice coefficient of a fuzzy match.
+        """
+        self.threshold = threshold
+        self.entries: list[dict] = []
+        self.sizes: list[int] = []
+        self.exact: dict[str, int] = dict()
+        self.grams: dict[str, list[int]] = dict()
+        self.hits = 0
+        self.misses = 0
+
+    def add(self, entry: dict) -> None:
+        if 'title' not in entry:
+            return
+        key = normalize_title(entry['title'])
+        if key == '' or key in self.exact:
+            return
+        idx = len(self.entries)
+        grams = trigrams(key)
+        self.entries.append(entry)
+        self.sizes.append(len(grams))
+        self.exact[key] = idx
+        for gram in grams:
+            self.grams.setdefault(gram, []).append(idx)
+
+    def add_file(self, bibfile: str) -> None:
+        for entry in bibload.load(bibfile).entries:
+            self.add(entry)
+
+    def lookup(self, title: str) -> dict | None:
+        """
+        :return: the local entry of title, None if not found.
+        """
+        key = normalize_title(title)
+        idx = self.exact.get(key, None)
+        if idx is None and key != '':
+            grams = trigrams(key)
+            shared: dict[int, int] = dict()
+            for gram in grams:
+                for other in self.grams.get(gram, ()):
+                    shared[other] = shared.get(other, 0) + 1
+            best = 0.0
+            for other, count in shared.items():
+                dice = 2 * count / (len(grams) + self.sizes[other])
+                if dice >= self.threshold and dice > best:
+                    idx, best = other, dice
+        if idx is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return self.entries[idx]
+
+    def stats(self) -> str:
+        total = self.hits + self.misses
+        rate = self.hits / total * 100 if total > 0 else 0.0
+        return f"Local index: {self.hits}/{total} titles resolved ({rate:.1f}%)"
+
+
+def default_bibfiles() -> list[str]:
+    root = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+    return sorted(glob.glob(os.path.join(root, 'dataset', '*.bib'))) \
+        + sorted(glob.glob(os.path.join(root, 'bibtex', '*.bib')))
+
+
+def build_index(bibfiles: list[str] | None = None, **kwargs) -> TitleIndex:
+    index = TitleIndex(**kwargs)
+    for lib in bibload.load_many(default_bibfiles() if bibfiles is None else bibfiles):
+        for entry in lib.entries:
+            index.add(entry)
+    return index
+
+
+if __name__ == "__main__":
+    args = sys.argv
+    if len(args) < 2:
+        print("Usage: titleindex.py <title>...", file=sys.stderr)
+        sys.exit(1)
+
+    index = build_index()
+    for title in args[1:]:
+        entry = index.lookup(title)
+        print(f"{title}: {'(not found)' if entry is None else entry['ID']}")
+    print(index.stats(), file=sys.stderr)